@@ -0,0 +1,265 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import datetime
+from html import escape
+
+from playwright.async_api import async_playwright
+
+from main import HistoryStore, OzonPvzBot, PointCoordinator, parse_outbound_html, save_to_files
+
+# Размеры блока по умолчанию
+SIZES = (10, 100, 1000, 10000)
+
+BASELINE_FILE = "benchmark_baseline.json"
+
+# Поэлементный разбор делает ~10 вызовов CDP на карточку; на больших блоках это минуты
+PER_ELEMENT_LIMIT = 2000
+
+NAMES = ["Футболка хлопковая", "Кроссовки беговые", "Чехол для телефона", "Наушники беспроводные",
+         "Рюкзак городской", "Набор посуды", "Книга", "Зарядное устройство", "Куртка демисезонная"]
+COLORS = ["черный", "белый", "синий", "красный", "зеленый", ""]
+SIZES_CLOTHES = ["XS", "S", "M", "L", "XL", "42", "44", ""]
+
+def generate_card(rng, barcode, flow_type, locked):
+    """Карточка товара в разметке страницы 'Отправка перевозок'"""
+    color = rng.choice(COLORS)
+    size = rng.choice(SIZES_CLOTHES)
+    cell = f"{rng.choice('ABCDEFGH')}-{rng.randint(1, 40)}-{rng.randint(1, 12)}"
+    parts = [
+        '<div class="_element_16tx4_1">',
+        '<div class="_locked_16tx4_13">Не подходит направление потока</div>' if locked else '',
+        f'<div class="_titleWrap_1ailj_14">{escape(rng.choice(NAMES))} #{barcode}</div>',
+        f'<div class="_barcode_1ailj_7">Штрихкод: {barcode}</div>',
+        f'<div class="_address_1ailj_28"><span class="ozi__badge__label__Rb41r">{cell}</span></div>',
+        f'<div class="_flowType_16tx4_203">{flow_type}</div>',
+        f'<div class="_flex_lxoww_1"><div>Цвет</div><div>{color}</div></div>' if color else '',
+        f'<div class="_content_1ailj_36">Размер {size}\nАртикул {rng.randint(10 ** 6, 10 ** 7)}</div>' if size else '',
+        '</div>',
+    ]
+    return "".join(parts)
+
+def generate_target_block(rng, first_barcode, item_count, locked_ratio, flow_type, shipment=None):
+    """Блок перевозки с информатором 'Добавьте содержимое в перевозку': сначала
+    доступные карточки, затем секция 'Не подходит направление потока' с заблокированными"""
+    locked_count = int(item_count * locked_ratio)
+    cards = [
+        generate_card(rng, first_barcode + i, flow_type, locked=i >= item_count - locked_count)
+        for i in range(item_count)
+    ]
+    header = f'<div class="_header">Перевозка №{shipment}</div>' if shipment else ''
+    return f"""<div class="_block_4j0aa_1">
+  {header}<div class="_informer">Добавьте содержимое в перевозку</div>
+  {"".join(cards[:item_count - locked_count])}
+  <div class="_section">Не подходит направление потока</div>
+  {"".join(cards[item_count - locked_count:])}
+</div>"""
+
+def generate_outbound_html(item_count, locked_ratio=0.2, flow_type="Прямой поток", seed=0, shipments=1):
+    """Синтетическая страница 'Отправка перевозок'
+
+    Вкладки типов потоков, блок перевозки без информатора и shipments целевых
+    блоков, между которыми поровну делятся item_count карточек. При
+    нескольких перевозках у блоков есть заголовок с номером.
+    """
+    rng = random.Random(seed)
+    per_block = item_count // shipments
+    target_blocks = "\n".join(
+        generate_target_block(rng, 10 ** 11 + n * per_block, per_block, locked_ratio, flow_type,
+                              shipment=f"{7000 + n}" if shipments > 1 else None)
+        for n in range(shipments)
+    )
+    other_block = "".join(generate_card(rng, 9 * 10 ** 11 + i, flow_type, locked=False) for i in range(3))
+    return f"""<!DOCTYPE html>
+<html lang="ru"><head><meta charset="utf-8"><title>Отправка перевозок</title></head>
+<body>
+<div class="_flowTypes">
+  <div class="_flowType_16tx4_203">Прямой поток</div>
+  <div class="_flowType_16tx4_203">Возвратный поток</div>
+</div>
+<div class="_block_4j0aa_1"><div>Перевозка уже сформирована</div>{other_block}</div>
+{target_blocks}
+</body></html>"""
+
+async def timed(results, name, coroutine):
+    started = time.perf_counter()
+    value = await coroutine
+    results[name] = time.perf_counter() - started
+    return value
+
+async def extract_from_html(bot):
+    """Путь --mode html: один запрос page.content(), разбор HTML в отдельном потоке"""
+    html = await bot.page.content()
+    shipments = await asyncio.to_thread(parse_outbound_html, html)
+    return bot.items_from_shipments(shipments)
+
+def expected_items(item_count, shipments=1):
+    per_block = item_count // shipments
+    return (per_block - int(per_block * 0.2)) * shipments
+
+async def bench_size(browser, item_count, workdir, shipments=1):
+    """Прогон этапов бота на фикстуре заданного размера"""
+    html = generate_outbound_html(item_count, shipments=shipments)
+    page = await browser.new_page()
+    await page.set_content(html)
+
+    bot = OzonPvzBot(interactive=False)
+    bot.page = page
+    results = {}
+
+    # Вывод бота (по строке на товар) в замеры не попадает
+    with contextlib.redirect_stdout(io.StringIO()):
+        await timed(results, 'select_flow_type', bot.select_flow_type("Прямой поток"))
+        target_blocks = await timed(results, 'find_target_blocks', bot.find_target_blocks())
+        items = await timed(results, 'extract_batch', bot.extract_shipments(target_blocks))
+        # Поиск блоков входит в разбор HTML, сравнивать с find_target_blocks + extract_batch
+        html_items = await timed(results, 'extract_html', extract_from_html(bot))
+        if item_count <= PER_ELEMENT_LIMIT:
+            started = time.perf_counter()
+            for _, block in target_blocks:
+                await bot.extract_items_before_locked_section(block, batch=False)
+            results['extract_per_element'] = time.perf_counter() - started
+
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            started = time.perf_counter()
+            save_to_files(items, "Прямой поток", bot.output_formats)
+            results['save_to_files'] = time.perf_counter() - started
+        finally:
+            os.chdir(cwd)
+
+    expected = expected_items(item_count, shipments)
+    if len(items) != expected:
+        print(f"⚠️  {item_count}: извлечено {len(items)} товаров вместо {expected}")
+    if len(html_items) != len(items):
+        print(f"⚠️  {item_count}: разбор HTML дал {len(html_items)} товаров, DOM - {len(items)}")
+    results['items'] = len(items)
+
+    await page.close()
+    return results
+
+async def smoke_points(playwright, point_count, processes, workdir, item_count=50):
+    """Сквозная проверка координатора пунктов на фикстурах
+    
+    Для каждого пункта запускается headless Chromium с отладочным портом;
+    запросы к turbo-pvz.ozon.ru отдают синтетическую страницу. Координатор
+    подключается к браузерам через CDP так же, как к Edge на пунктах, с
+    историей в SQLite и при processes > 1 - в дочерних процессах.
+    """
+    html = generate_outbound_html(item_count)
+    outbound_url = "https://turbo-pvz.ozon.ru/outbound?id=-1000"
+    
+    async def fixture(route):
+        await route.fulfill(body=html, content_type="text/html; charset=utf-8")
+    
+    contexts = []
+    points = []
+    for i in range(point_count):
+        port = 9400 + i
+        context = await playwright.chromium.launch_persistent_context(
+            os.path.join(workdir, f"profile_{i}"), headless=True, args=[f"--remote-debugging-port={port}"],
+        )
+        await context.route("https://turbo-pvz.ozon.ru/**", fixture)
+        page = context.pages[0] if context.pages else await context.new_page()
+        await page.goto(outbound_url)
+        contexts.append(context)
+        
+        # Адрес страницы перевозок уже известен: бот не ищет меню, которого нет на фикстуре
+        selector_cache_file = os.path.join(workdir, f"selector_cache_{i}.json")
+        with open(selector_cache_file, 'w', encoding='utf-8') as f:
+            json.dump({'transport_url': outbound_url}, f)
+        points.append({'name': f"Фикстура {i + 1}", 'cdp_url': f"http://127.0.0.1:{port}",
+                       'selector_cache_file': selector_cache_file})
+    
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        coordinator = PointCoordinator(points, ["Прямой поток"], processes=processes, output_formats=("csv",),
+                                       history=HistoryStore(os.path.join(workdir, "history.sqlite3")))
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = await coordinator.run()
+    finally:
+        os.chdir(cwd)
+        for context in contexts:
+            await context.close()
+    
+    expected = expected_items(item_count)
+    runs = coordinator.history.run_counts()
+    failed = [r for r in results if r['status'] != "ok" or len(r['items']) != expected]
+    for result in results:
+        print(f"{result['point']:>12}: {result['status']}, товаров {len(result['items'])} из {expected} {result['error']}")
+    print(f"{'История':>12}: запусков {len(runs)} из {point_count}")
+    return not failed and len(runs) == point_count
+
+def print_table(results, baseline=None):
+    """Таблица замеров; при наличии базовой линии — отношение к ней"""
+    stages = ['select_flow_type', 'find_target_blocks', 'extract_batch', 'extract_html', 'extract_per_element',
+              'save_to_files']
+    print(f"\n{'Товаров':>8} " + " ".join(f"{stage:>20}" for stage in stages))
+    for size, measured in results.items():
+        cells = []
+        for stage in stages:
+            if stage not in measured:
+                cells.append(f"{'—':>20}")
+                continue
+            cell = f"{measured[stage]:.3f} с"
+            base = (baseline or {}).get(size, {}).get(stage)
+            if base:
+                cell += f" ({measured[stage] / base:.2f}x)"
+            cells.append(f"{cell:>20}")
+        print(f"{size:>8} " + " ".join(cells))
+
+async def main():
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк бота на синтетических страницах")
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)),
+                        help="размеры блока через запятую (по умолчанию 10,100,1000,10000)")
+    parser.add_argument("--update-baseline", action="store_true",
+                        help=f"сохранить результаты как базовую линию в {BASELINE_FILE}")
+    parser.add_argument("--shipments", type=int, default=1,
+                        help="число перевозок с информатором на странице (товары делятся между ними)")
+    parser.add_argument("--smoke-points", type=int, metavar="N",
+                        help="сквозная проверка координатора на N пунктах-фикстурах вместо замеров")
+    parser.add_argument("--processes", type=int, default=2,
+                        help="процессов координатора для --smoke-points (по умолчанию 2)")
+    args = parser.parse_args()
+    
+    if args.smoke_points:
+        async with async_playwright() as playwright:
+            with tempfile.TemporaryDirectory() as workdir:
+                passed = await smoke_points(playwright, args.smoke_points, args.processes, workdir)
+        print("✅ Проверка пройдена" if passed else "❌ Проверка не пройдена")
+        raise SystemExit(0 if passed else 1)
+    
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    baseline = None
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+
+    results = {}
+    async with async_playwright() as playwright:
+        browser = await playwright.chromium.launch(headless=True)
+        with tempfile.TemporaryDirectory() as workdir:
+            for size in sizes:
+                print(f"⏳ Блок из {size} товаров...")
+                results[str(size)] = await bench_size(browser, size, workdir, args.shipments)
+        await browser.close()
+
+    print_table(results, baseline)
+
+    if args.update_baseline:
+        with open(BASELINE_FILE, 'w', encoding='utf-8') as f:
+            json.dump({'recorded_at': datetime.now().isoformat(timespec='seconds'), 'results': results},
+                      f, ensure_ascii=False, indent=2)
+        print(f"💾 Базовая линия сохранена: {BASELINE_FILE}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
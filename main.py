@@ -1,22 +1,1390 @@
+import argparse
 import asyncio
-from playwright.async_api import async_playwright
-import pandas as pd
+import bisect
+import contextlib
+import contextvars
+import copy
+import csv
+import glob
+import gzip
+import inspect
+import json
+import re
+import shutil
+import sqlite3
+from collections import OrderedDict
+from dataclasses import dataclass, fields
+from typing import ClassVar
+from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
 from datetime import datetime
 import os
-import psutil
+import sys
 import subprocess
 import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
 
-class OzonPvzBot:
+# Разбор одной карточки товара прямо в странице. Возвращает «сырые» тексты
+# полей, дальнейшая обработка общая с поэлементным путем (см. _make_item)
+PARSE_CARD_JS = """
+function parseCard(el) {
+    const text = (selector) => {
+        const node = el.querySelector(selector);
+        return node ? node.textContent : null;
+    };
+    return {
+        name: text("div._titleWrap_1ailj_14"),
+        barcode: text("div._barcode_1ailj_7"),
+        location: text("div._address_1ailj_28 .ozi__badge__label__Rb41r"),
+        flow_type: text("div._flowType_16tx4_203"),
+        color: text("div._flex_lxoww_1 div:last-child"),
+        content: text("div._content_1ailj_36"),
+        locked: el.querySelector("div._locked_16tx4_13") !== null,
+    };
+}
+"""
+
+# Отпечаток содержимого карточки: все поля берутся из textContent, плюс признак блокировки
+FINGERPRINT_CARD_JS = """
+function fingerprintCard(el) {
+    const text = el.textContent + (el.querySelector("div._locked_16tx4_13") ? "|locked" : "");
+    let hash = 5381;
+    for (let i = 0; i < text.length; i++) {
+        hash = ((hash << 5) + hash + text.charCodeAt(i)) | 0;
+    }
+    return (hash >>> 0).toString(36) + ":" + text.length;
+}
+"""
+
+FINGERPRINTS_JS = "(elements) => {" + FINGERPRINT_CARD_JS + " return elements.map(fingerprintCard); }"
+
+# Все карточки блока за один вызов eval_on_selector_all; отпечаток отличает
+# при прокрутке карточки без штрихкода друг от друга
+BATCH_EXTRACT_JS = (
+    "(elements) => {" + PARSE_CARD_JS + FINGERPRINT_CARD_JS
+    + " return elements.map((el) => ({...parseCard(el), fingerprint: fingerprintCard(el)})); }"
+)
+
+# Разбор только карточек с указанными индексами (с отпечатком для сверки)
+SELECTED_EXTRACT_JS = (
+    "(elements, indexes) => {" + PARSE_CARD_JS + FINGERPRINT_CARD_JS
+    + " return indexes.map((i) => [fingerprintCard(elements[i]), parseCard(elements[i])]); }"
+)
+
+# Наблюдение за целевым блоком: MutationObserver сообщает в Python (через
+# функцию bindingName из expose_binding) добавленные, измененные и убранные
+# карточки, уже разобранные parseCard, с перевозкой блока. Изменения копятся
+# 100 мс и уходят одной пачкой. Возвращает начальное состояние блока
+WATCH_BLOCK_JS = (
+    "(block, [bindingName, shipment]) => {" + PARSE_CARD_JS + FINGERPRINT_CARD_JS + """
+    if (block.__ozonPvzWatch) {
+        block.__ozonPvzWatch.disconnect();
+    }
+    const known = new Map();
+    const collectChanges = () => {
+        const changes = {shipment, added: [], modified: [], removed: []};
+        const current = new Set(block.querySelectorAll("div._element_16tx4_1"));
+        for (const el of current) {
+            const fingerprint = fingerprintCard(el);
+            const previous = known.get(el);
+            if (previous && previous[0] === fingerprint) {
+                continue;
+            }
+            const raw = parseCard(el);
+            // Свой номер у каждой карточки: у товаров без штрихкода другого ключа нет
+            raw.watchId = previous ? previous[1].watchId : (window.__ozonPvzWatchSeq = (window.__ozonPvzWatchSeq || 0) + 1);
+            known.set(el, [fingerprint, raw]);
+            if (previous) {
+                changes.modified.push(raw);
+            } else {
+                changes.added.push(raw);
+            }
+        }
+        for (const [el, [, raw]] of known) {
+            if (!current.has(el)) {
+                known.delete(el);
+                changes.removed.push(raw);
+            }
+        }
+        return changes;
+    };
+    let scheduled = false;
+    const flush = () => {
+        scheduled = false;
+        const changes = collectChanges();
+        if (changes.added.length || changes.modified.length || changes.removed.length) {
+            window[bindingName](changes);
+        }
+    };
+    const observer = new MutationObserver(() => {
+        if (!scheduled) {
+            scheduled = true;
+            setTimeout(flush, 100);
+        }
+    });
+    observer.observe(block, {childList: true, subtree: true, characterData: true, attributes: true});
+    block.__ozonPvzWatch = observer;
+    return collectChanges();
+}
+""")
+
+# Блоки перевозок с информатором и номера перевозок из заголовков блоков (текст
+# вне карточек товаров, пустая строка без номера) - одним вызовом, чтобы
+# перерисовка страницы не развела блоки и номера
+TARGET_BLOCKS_JS = """
+([selector, informer]) => {
+    const shipmentNumber = (block) => {
+        const walker = document.createTreeWalker(block, NodeFilter.SHOW_TEXT, {
+            acceptNode: (node) => node.parentElement.closest("div._element_16tx4_1")
+                ? NodeFilter.FILTER_REJECT : NodeFilter.FILTER_ACCEPT,
+        });
+        let header = "";
+        while (walker.nextNode()) {
+            header += " " + walker.currentNode.textContent;
+        }
+        const number = header.match(/№\\s*([\\w-]+)/);
+        return number ? number[1] : "";
+    };
+    const blocks = [...document.querySelectorAll(selector)];
+    const targets = blocks.filter((block) => block.textContent.includes(informer));
+    return {total: blocks.length, blocks: targets, shipments: targets.map(shipmentNumber)};
+}
+"""
+
+# Состояние списка товаров для ожидания после клика по типу потока: отпечаток
+# всего списка и признак того, что у всех карточек указан нужный тип потока
+FLOW_LIST_STATE_JS = """
+(elements, flowType) => {
+    let hash = 5381;
+    let matching = 0;
+    for (const el of elements) {
+        const text = el.textContent;
+        for (let i = 0; i < text.length; i++) {
+            hash = ((hash << 5) + hash + text.charCodeAt(i)) | 0;
+        }
+        const flow = el.querySelector("div._flowType_16tx4_203");
+        if (flow && flow.textContent.includes(flowType)) {
+            matching++;
+        }
+    }
+    return {signature: elements.length + ":" + (hash >>> 0).toString(36),
+            matches: elements.length > 0 && matching === elements.length};
+}
+"""
+
+# Прокрутка ближайшего прокручиваемого контейнера блока на step пикселей.
+# Возвращает True, если контейнер прокручен до конца
+SCROLL_BLOCK_JS = """
+(block, step) => {
+    let node = block;
+    while (node && node !== document.body) {
+        const overflow = getComputedStyle(node).overflowY;
+        if (node.scrollHeight > node.clientHeight && (overflow === "auto" || overflow === "scroll")) {
+            break;
+        }
+        node = node.parentElement;
+    }
+    const scroller = node && node !== document.body ? node : document.scrollingElement;
+    scroller.scrollTop = scroller.scrollTop + step;
+    return scroller.scrollTop + scroller.clientHeight >= scroller.scrollHeight - 2;
+}
+"""
+
+# Поля, изменения которых попадают в отчет об изменениях
+DIFF_FIELDS = ('Ячейка', 'Статус_блокировки', 'Тип_потока')
+
+# Поля, по которым различаются товары без штрихкода в снимках для --diff
+DIFF_FINGERPRINT_FIELDS = ('Название', 'Цвет', 'Размер', 'Перевозка')
+
+# Типы потоков на странице 'Отправка перевозок'
+FLOW_TYPES = ("Прямой поток", "Возвратный поток")
+
+# Варианты ключей полей товара в JSON-ответах бэкенда страницы отправки
+API_ITEM_FIELDS = {
+    'name': ('name', 'title', 'itemName', 'productName', 'articleName'),
+    'barcode': ('barcode', 'barCode', 'itemBarcode', 'postingBarcode'),
+    'location': ('address', 'cell', 'cellName', 'placeName', 'location', 'storagePlace'),
+    'flow_type': ('flowType', 'flowTypeName', 'flowName', 'flow'),
+    'color': ('color', 'colorName'),
+    'size': ('size', 'sizeName'),
+    'locked': ('isLocked', 'locked', 'isBlocked', 'blocked', 'isWrongFlow', 'wrongFlow'),
+}
+
+# Слова ключей, под которыми бэкенд отдает товары с неподходящим направлением потока
+API_LOCKED_GROUP_MARKERS = ('locked', 'blocked', 'wrong', 'unsuitable', 'notsuitable')
+
+# Отрицания перед словом-маркером (notBlocked, nonLocked) снимают признак блокировки
+API_KEY_NEGATIONS = ('not', 'non', 'no')
+
+# Слова ключа в camelCase, snake_case и kebab-case
+API_KEY_TOKEN_RE = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+")
+
+# Части URL запросов, ответы которых перехватываются в режиме API
+API_URL_MARKERS = ('outbound', 'transport', 'carriage', 'flow', 'shipment')
+
+# Колонки отчетов в порядке полей записи о товаре
+ITEM_COLUMNS = ('№', 'Название', 'Штрихкод', 'Ячейка', 'Тип_потока', 'Цвет', 'Размер',
+                'Статус_блокировки', 'Статус_оформления')
+
+@dataclass(slots=True)
+class ShipmentItem:
+    """Запись о товаре без словаря на каждый экземпляр
+    
+    Поддерживает доступ по ключам отчетов (item['Ячейка']) и dict(item),
+    поэтому код отчетов работает с ней так же, как со словарем.
+    """
+    index: int
+    name: str
+    barcode: str
+    cell: str
+    flow_type: str
+    color: str
+    size: str
+    lock_status: str
+    status: str
+    point: str = ""
+    shipment: str = ""
+    
+    # Ключ отчета -> атрибут
+    KEYS: ClassVar[dict] = {
+        '№': 'index',
+        'Название': 'name',
+        'Штрихкод': 'barcode',
+        'Ячейка': 'cell',
+        'Тип_потока': 'flow_type',
+        'Цвет': 'color',
+        'Размер': 'size',
+        'Статус_блокировки': 'lock_status',
+        'Статус_оформления': 'status',
+        'Пункт': 'point',
+        'Перевозка': 'shipment',
+    }
+    
+    def __getitem__(self, key):
+        try:
+            return getattr(self, self.KEYS[key])
+        except KeyError:
+            raise KeyError(key) from None
+    
+    def get(self, key, default=None):
+        return getattr(self, self.KEYS[key]) if key in self.KEYS else default
+    
+    def keys(self):
+        return self.KEYS.keys()
+
+class ItemBatch:
+    """Колоночный контейнер товаров: по списку значений на каждое поле
+    
+    Экстракторы дописывают товары сюда, а не в список словарей. Итерация и
+    индексация отдают ShipmentItem, которые создаются на лету.
+    """
+    __slots__ = ('columns',)
+    
+    FIELDS = tuple(field.name for field in fields(ShipmentItem))
+    
+    def __init__(self, items=()):
+        self.columns = {name: [] for name in self.FIELDS}
+        self.extend(items)
+    
+    def append(self, item):
+        """Добавление ShipmentItem или словаря с ключами отчетов"""
+        if not isinstance(item, ShipmentItem):
+            item = ShipmentItem(**{name: item[key] for key, name in ShipmentItem.KEYS.items() if key in item})
+        for name in self.FIELDS:
+            self.columns[name].append(getattr(item, name))
+    
+    def extend(self, items):
+        if isinstance(items, ItemBatch):
+            for name in self.FIELDS:
+                self.columns[name].extend(items.columns[name])
+            return
+        for item in items:
+            self.append(item)
+    
+    def __len__(self):
+        return len(self.columns['index'])
+    
+    def __getitem__(self, position):
+        return ShipmentItem(*(self.columns[name][position] for name in self.FIELDS))
+    
+    def __iter__(self):
+        return (ShipmentItem(*values) for values in zip(*self.columns.values()))
+    
+    def tag(self, name, value):
+        """Заполнение поля одним значением для всех товаров (например, пункта выдачи)"""
+        self.columns[name] = [value] * len(self)
+    
+    def report_columns(self, keys=ITEM_COLUMNS):
+        """Колонки под ключами отчетов"""
+        return {key: self.columns[ShipmentItem.KEYS[key]] for key in keys}
+    
+    def to_dataframe(self):
+        import pandas as pd
+        return pd.DataFrame(self.report_columns())
+    
+    def to_arrow(self):
+        import pyarrow as pa
+        return pa.table(self.report_columns())
+
+class ItemWriter:
+    """Потоковая запись товаров в файл: записи дописываются пачками по мере разбора"""
+    extension = None
+    label = None
+    
+    def __init__(self, base_filename, flow_type, columns=ITEM_COLUMNS):
+        self.filename = f"{base_filename}.{self.extension}"
+        self.flow_type = flow_type
+        self.columns = columns
+        self.count = 0
+    
+    def write(self, items):
+        for item in items:
+            self.count += 1
+            self.write_item(item)
+    
+    def write_item(self, item):
+        raise NotImplementedError
+    
+    def close(self):
+        pass
+
+class CsvItemWriter(ItemWriter):
+    """CSV с BOM, чтобы Excel правильно открывал кириллицу"""
+    extension = "csv"
+    label = "CSV файл"
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._file = open(self.filename, 'w', encoding='utf-8-sig', newline='')
+        self._writer = csv.writer(self._file, delimiter=';')
+        self._writer.writerow(self.columns)
+    
+    def write_item(self, item):
+        self._writer.writerow([item[column] for column in self.columns])
+    
+    def close(self):
+        self._file.close()
+
+class JsonlItemWriter(ItemWriter):
+    """Один JSON-объект на строку"""
+    extension = "jsonl"
+    label = "JSONL файл"
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._file = open(self.filename, 'w', encoding='utf-8')
+    
+    def write_item(self, item):
+        self._file.write(json.dumps({column: item[column] for column in self.columns}, ensure_ascii=False) + "\n")
+    
+    def close(self):
+        self._file.close()
+
+class ParquetItemWriter(ItemWriter):
+    """Parquet: каждая пачка записывается отдельной группой строк (нужен pyarrow)"""
+    extension = "parquet"
+    label = "Parquet файл"
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self._pa = pa
+        self._schema = pa.schema([(column, pa.int64() if column == '№' else pa.string()) for column in self.columns])
+        self._writer = pq.ParquetWriter(self.filename, self._schema)
+    
+    def write(self, items):
+        if not items:
+            return
+        self.count += len(items)
+        if isinstance(items, ItemBatch):
+            data = items.report_columns(self.columns)
+        else:
+            data = {column: [item[column] for item in items] for column in self.columns}
+        table = self._pa.Table.from_pydict(data, schema=self._schema)
+        self._writer.write_table(table)
+    
+    def close(self):
+        self._writer.close()
+
+class XlsxItemWriter(ItemWriter):
+    """Excel в режиме write-only openpyxl: строки не держатся в памяти целиком"""
+    extension = "xlsx"
+    label = "Excel файл"
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        from openpyxl import Workbook
+        self._workbook = Workbook(write_only=True)
+        self._sheet = self._workbook.create_sheet("Sheet1")
+        self._sheet.append(list(self.columns))
+    
+    def write_item(self, item):
+        self._sheet.append([item[column] for column in self.columns])
+    
+    def close(self):
+        self._workbook.save(self.filename)
+
+class TxtItemWriter(ItemWriter):
+    """Текстовый отчет; количество товаров в шапке известно только в конце,
+    поэтому тело пишется во временный файл и склеивается при закрытии"""
+    extension = "txt"
+    label = "TXT отчет"
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._body = open(self.filename + ".part", 'w+', encoding='utf-8')
+    
+    def write_item(self, item):
+        f = self._body
+        f.write(f"ТОВАР #{self.count}\n")
+        f.write(f"Название: {item['Название']}\n")
+        f.write(f"Ячейка: {item['Ячейка']}\n")
+        f.write(f"Штрихкод: {item['Штрихкод']}\n")
+        f.write(f"Тип потока: {item['Тип_потока']}\n")
+        if item['Цвет']:
+            f.write(f"Цвет: {item['Цвет']}\n")
+        if item['Размер']:
+            f.write(f"Размер: {item['Размер']}\n")
+        f.write(f"Статус блокировки: {item['Статус_блокировки']}\n")
+        if 'Пункт' in self.columns:
+            f.write(f"Пункт: {item['Пункт']}\n")
+        if 'Перевозка' in self.columns:
+            f.write(f"Перевозка: {item['Перевозка']}\n")
+        f.write("-" * 40 + "\n\n")
+    
+    def close(self):
+        try:
+            with open(self.filename, 'w', encoding='utf-8') as f:
+                f.write(f"ОТЧЕТ: {self.flow_type}\n")
+                f.write(f"Дата: {datetime.now().strftime('%d.%m.%Y %H:%M:%S')}\n")
+                f.write(f"Товаров ДО секции 'Не подходит направление потока': {self.count}\n")
+                f.write("=" * 60 + "\n\n")
+                self._body.seek(0)
+                shutil.copyfileobj(self._body, f)
+        finally:
+            self._body.close()
+            os.remove(self._body.name)
+
+ITEM_WRITERS = {
+    'xlsx': XlsxItemWriter,
+    'txt': TxtItemWriter,
+    'csv': CsvItemWriter,
+    'jsonl': JsonlItemWriter,
+    'parquet': ParquetItemWriter,
+}
+
+def report_base_filename(flow_type, prefix="ozon_shipment"):
+    """Путь к файлам отчета без расширения"""
+    os.makedirs("results", exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return f"results/{prefix}_{flow_type.replace(' ', '_')}_{timestamp}"
+
+def item_report_columns(items_data, columns=ITEM_COLUMNS):
+    """Колонки отчета; 'Перевозка' добавляется, если товары собраны из нескольких перевозок"""
+    if isinstance(items_data, ItemBatch):
+        shipments = items_data.columns['shipment']
+    else:
+        shipments = (item['Перевозка'] for item in items_data)
+    return columns + ('Перевозка',) if any(shipments) else columns
+
+def open_writers(base_filename, flow_type, formats, columns=ITEM_COLUMNS):
+    return [ITEM_WRITERS[fmt](base_filename, flow_type, columns) for fmt in formats]
+
+def save_to_files(items_data, flow_type, formats=("xlsx", "txt"), columns=ITEM_COLUMNS):
+    """Сохранение в файлы"""
+    if not items_data:
+        return
+    
+    base_filename = report_base_filename(flow_type)
+    columns = item_report_columns(items_data, columns)
+    for writer in open_writers(base_filename, flow_type, formats, columns):
+        writer.write(items_data)
+        writer.close()
+        print(f"💾 {writer.label} сохранен: {writer.filename}")
+
+class StreamingSink:
+    """Запись товаров по мере разбора во все выбранные форматы
+    
+    Товары копятся пачками по chunk_size и записываются в отдельном потоке,
+    чтобы запись файлов не останавливала работу с браузером. Пока пишется
+    одна пачка, набирается следующая.
+    """
+    
+    def __init__(self, flow_type, formats=("xlsx", "txt"), columns=ITEM_COLUMNS, chunk_size=200):
+        self.flow_type = flow_type
+        self.formats = formats
+        self.columns = columns
+        self.chunk_size = chunk_size
+        self.writers = []
+        self.count = 0
+        self._buffer = []
+        self._pending = None
+    
+    async def __aenter__(self):
+        base_filename = report_base_filename(self.flow_type)
+        self.writers = await asyncio.to_thread(open_writers, base_filename, self.flow_type, self.formats, self.columns)
+        return self
+    
+    async def write(self, item):
+        self._buffer.append(item)
+        self.count += 1
+        if len(self._buffer) >= self.chunk_size:
+            await self.flush()
+    
+    async def consume(self, items):
+        """Запись всех товаров из асинхронного генератора"""
+        async for item in items:
+            await self.write(item)
+        return self.count
+    
+    async def flush(self):
+        if self._pending:
+            await self._pending
+        batch, self._buffer = self._buffer, []
+        self._pending = asyncio.ensure_future(asyncio.to_thread(self._write_batch, batch))
+    
+    def _write_batch(self, batch):
+        for writer in self.writers:
+            writer.write(batch)
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            await self.flush()
+            await self._pending
+        finally:
+            # Ошибка записи пачки не должна оставлять открытые файлы и *.txt.part
+            for writer in self.writers:
+                try:
+                    await asyncio.to_thread(writer.close)
+                except Exception as e:
+                    print(f"❌ {writer.label} не сохранен: {e}")
+                    continue
+                print(f"💾 {writer.label} сохранен: {writer.filename}")
+
+# Сохраненные страницы 'Отправка перевозок' для повторного разбора без браузера
+PAGE_SNAPSHOT_DIR = "results/html_snapshots"
+
+# Информатор целевого блока перевозки
+TARGET_INFORMER = "Добавьте содержимое в перевозку"
+
+def _class_xpath(class_name):
+    """XPath-условие на класс элемента, как у CSS-селектора .class_name"""
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {class_name} ')"
+
+# Те же поля, что у parseCard, для разбора через lxml
+CARD_FIELD_XPATHS = {
+    'name': f".//div[{_class_xpath('_titleWrap_1ailj_14')}]",
+    'barcode': f".//div[{_class_xpath('_barcode_1ailj_7')}]",
+    'location': f".//div[{_class_xpath('_address_1ailj_28')}]//*[{_class_xpath('ozi__badge__label__Rb41r')}]",
+    'flow_type': f".//div[{_class_xpath('_flowType_16tx4_203')}]",
+    'color': f".//div[{_class_xpath('_flex_lxoww_1')}]//div[not(following-sibling::*)]",
+    'content': f".//div[{_class_xpath('_content_1ailj_36')}]",
+}
+
+# ... и через selectolax
+CARD_FIELD_SELECTORS = {
+    'name': "div._titleWrap_1ailj_14",
+    'barcode': "div._barcode_1ailj_7",
+    'location': "div._address_1ailj_28 .ozi__badge__label__Rb41r",
+    'flow_type': "div._flowType_16tx4_203",
+    'color': "div._flex_lxoww_1 div:last-child",
+    'content': "div._content_1ailj_36",
+}
+
+# Номер перевозки в заголовке блока, как в TARGET_BLOCKS_JS
+SHIPMENT_NUMBER_RE = re.compile(r"№\s*([\w-]+)", re.ASCII)
+
+def _shipment_number(header, position):
+    number = SHIPMENT_NUMBER_RE.search(header)
+    return number.group(1) if number else f"#{position}"
+
+def _parse_cards_selectolax(html):
+    from selectolax.lexbor import LexborHTMLParser
+    shipments = []
+    for block in LexborHTMLParser(html).css("div._block_4j0aa_1"):
+        header = block.text(deep=True)
+        if TARGET_INFORMER not in header:
+            continue
+        raw_items = []
+        for card in block.css("div._element_16tx4_1"):
+            # Заголовок блока - текст вне карточек
+            header = header.replace(card.text(deep=True), " ", 1)
+            raw = {}
+            for field, selector in CARD_FIELD_SELECTORS.items():
+                node = card.css_first(selector)
+                raw[field] = node.text(deep=True) if node is not None else None
+            raw['locked'] = card.css_first("div._locked_16tx4_13") is not None
+            raw_items.append(raw)
+        shipments.append((_shipment_number(header, len(shipments) + 1), raw_items))
+    return shipments
+
+def _parse_cards_lxml(html):
+    import lxml.html
+    tree = lxml.html.fromstring(html)
+    card_class = _class_xpath('_element_16tx4_1')
+    shipments = []
+    for block in tree.xpath(f"//div[{_class_xpath('_block_4j0aa_1')}]"):
+        if TARGET_INFORMER not in block.text_content():
+            continue
+        raw_items = []
+        for card in block.xpath(f".//div[{card_class}]"):
+            raw = {}
+            for field, xpath in CARD_FIELD_XPATHS.items():
+                nodes = card.xpath(xpath)
+                raw[field] = nodes[0].text_content() if nodes else None
+            raw['locked'] = bool(card.xpath(f".//div[{_class_xpath('_locked_16tx4_13')}]"))
+            raw_items.append(raw)
+        header = " ".join(block.xpath(f".//text()[not(ancestor::div[{card_class}])]"))
+        shipments.append((_shipment_number(header, len(shipments) + 1), raw_items))
+    return shipments
+
+def parse_outbound_html(html):
+    """Сырые поля карточек всех целевых блоков из HTML страницы 'Отправка перевозок'
+    
+    Правила те же, что у живого пути: блоки _block_4j0aa_1 с информатором,
+    все их карточки с признаком блокировки. Возвращает список (перевозка,
+    карточки); пустой - целевых блоков нет. Разбор идет через selectolax,
+    если он установлен, иначе через lxml.
+    """
+    try:
+        return _parse_cards_selectolax(html)
+    except ImportError:
+        pass
+    try:
+        return _parse_cards_lxml(html)
+    except ImportError:
+        raise RuntimeError("для разбора сохраненных страниц нужен selectolax или lxml: pip install selectolax")
+
+def page_snapshot_filename(flow_type):
+    return f"{PAGE_SNAPSHOT_DIR}/outbound_{flow_type.replace(' ', '_')}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.html.gz"
+
+def save_page_snapshot(html, flow_type):
+    """Сохранение HTML страницы в gzip; возвращает путь к файлу"""
+    os.makedirs(PAGE_SNAPSHOT_DIR, exist_ok=True)
+    filename = page_snapshot_filename(flow_type)
+    with gzip.open(filename, 'wt', encoding='utf-8', compresslevel=6) as f:
+        f.write(html)
+    return filename
+
+def parse_page_snapshot(filename):
+    """Разбор сохраненной страницы; функция верхнего уровня, чтобы работать в пуле процессов"""
+    opener = gzip.open if filename.endswith(".gz") else open
+    with opener(filename, 'rt', encoding='utf-8') as f:
+        return parse_outbound_html(f.read())
+
+def page_snapshot_flow_type(filename, default=FLOW_TYPES[0]):
+    """Тип потока по имени файла сохраненной страницы"""
+    name = os.path.basename(filename)
+    for flow_type in FLOW_TYPES:
+        if flow_type.replace(' ', '_') in name:
+            return flow_type
+    return default
+
+# Типы ресурсов, которые не нужны для разбора страницы
+BLOCKED_RESOURCE_TYPES = ("image", "media", "font")
+
+# Сторонние счетчики, реклама и телеметрия
+BLOCKED_URL_MARKERS = (
+    "google-analytics.com", "googletagmanager.com", "doubleclick.net", "mc.yandex.ru",
+    "top-fwz1.mail.ru", "sentry.io", "facebook.net", "hotjar.com", "/metrika/", "/telemetry", "/analytics",
+)
+
+class HistoryStore:
+    """История запусков в SQLite вместо отдельных файлов на каждый запуск
+    
+    Журнал WAL: чтение истории не блокирует запись нового запуска. Товары
+    запуска вставляются одной транзакцией через executemany.
+    """
+    
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS runs (
+        id INTEGER PRIMARY KEY,
+        started_at TEXT NOT NULL,
+        flow_type TEXT NOT NULL,
+        point TEXT NOT NULL DEFAULT '',
+        item_count INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS items (
+        run_id INTEGER NOT NULL REFERENCES runs(id),
+        position INTEGER NOT NULL,
+        name TEXT,
+        barcode TEXT,
+        cell TEXT,
+        flow_type TEXT,
+        color TEXT,
+        size TEXT,
+        lock_status TEXT,
+        status TEXT,
+        point TEXT,
+        shipment TEXT NOT NULL DEFAULT ''
+    );
+    CREATE INDEX IF NOT EXISTS idx_items_barcode ON items(barcode);
+    CREATE INDEX IF NOT EXISTS idx_items_cell ON items(cell);
+    CREATE INDEX IF NOT EXISTS idx_items_flow_type ON items(flow_type);
+    CREATE INDEX IF NOT EXISTS idx_items_run_id ON items(run_id);
+    CREATE INDEX IF NOT EXISTS idx_runs_started_at ON runs(started_at);
+    """
+    
+    # Колонки таблицы items в порядке полей ShipmentItem
+    ITEM_FIELDS = ('index', 'name', 'barcode', 'cell', 'flow_type', 'color', 'size', 'lock_status', 'status', 'point',
+                   'shipment')
+    
+    def __init__(self, path="results/history.sqlite3"):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Запись идет из рабочего потока (asyncio.to_thread)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(self.SCHEMA)
+    
+    def add_run(self, items_data, flow_type, point="", started_at=None):
+        """Сохранение запуска; возвращает его номер"""
+        started_at = (started_at or datetime.now()).isoformat(timespec='seconds')
+        if not isinstance(items_data, ItemBatch):
+            items_data = ItemBatch(items_data)
+        
+        with self.connection:
+            run_id = self.connection.execute(
+                "INSERT INTO runs (started_at, flow_type, point, item_count) VALUES (?, ?, ?, ?)",
+                (started_at, flow_type, point, len(items_data)),
+            ).lastrowid
+            columns = [items_data.columns[name] for name in self.ITEM_FIELDS]
+            self.connection.executemany(
+                "INSERT INTO items (run_id, position, name, barcode, cell, flow_type, color, size, lock_status, status, "
+                "point, shipment) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                ((run_id, *row) for row in zip(*columns)),
+            )
+        return run_id
+    
+    def item_history(self, barcode):
+        """Все появления товара по запускам"""
+        return self.connection.execute(
+            "SELECT runs.id AS run_id, runs.started_at, items.flow_type, items.cell, items.lock_status, items.point "
+            "FROM items JOIN runs ON runs.id = items.run_id WHERE items.barcode = ? ORDER BY runs.started_at",
+            (barcode,),
+        ).fetchall()
+    
+    def dwell_time(self, barcode):
+        """Сколько товар пролежал в каждой ячейке: первое и последнее появление"""
+        rows = self.connection.execute(
+            "SELECT items.cell, MIN(runs.started_at) AS first_seen, MAX(runs.started_at) AS last_seen, "
+            "COUNT(*) AS runs FROM items JOIN runs ON runs.id = items.run_id "
+            "WHERE items.barcode = ? GROUP BY items.cell ORDER BY first_seen",
+            (barcode,),
+        ).fetchall()
+        result = []
+        for row in rows:
+            duration = datetime.fromisoformat(row['last_seen']) - datetime.fromisoformat(row['first_seen'])
+            result.append({**dict(row), 'duration': duration})
+        return result
+    
+    def run_counts(self, limit=20):
+        """Последние запуски с количеством товаров"""
+        return self.connection.execute(
+            "SELECT id, started_at, flow_type, point, item_count FROM runs ORDER BY started_at DESC, id DESC LIMIT ?",
+            (limit,),
+        ).fetchall()
+    
+    def load_run(self, run_id):
+        """Запуск и его товары"""
+        run = self.connection.execute("SELECT * FROM runs WHERE id = ?", (run_id,)).fetchone()
+        if run is None:
+            return None, None
+        items_data = ItemBatch()
+        rows = self.connection.execute(
+            "SELECT position, name, barcode, cell, flow_type, color, size, lock_status, status, point, shipment "
+            "FROM items WHERE run_id = ? ORDER BY rowid",
+            (run_id,),
+        )
+        for row in rows:
+            items_data.append(ShipmentItem(*row))
+        return run, items_data
+    
+    def export_run(self, run_id, formats=("xlsx", "txt")):
+        """Выгрузка запуска в файлы того же вида, что пишет save_to_files"""
+        run, items_data = self.load_run(run_id)
+        if run is None:
+            print(f"❌ Запуск #{run_id} не найден")
+            return []
+        
+        os.makedirs("results", exist_ok=True)
+        timestamp = datetime.fromisoformat(run['started_at']).strftime("%Y%m%d_%H%M%S")
+        base_filename = f"results/ozon_shipment_{run['flow_type'].replace(' ', '_')}_{timestamp}"
+        columns = item_report_columns(items_data, ITEM_COLUMNS + ('Пункт',) if run['point'] else ITEM_COLUMNS)
+        writers = open_writers(base_filename, run['flow_type'], formats, columns)
+        for writer in writers:
+            writer.write(items_data)
+            writer.close()
+            print(f"💾 {writer.label} сохранен: {writer.filename}")
+        return [writer.filename for writer in writers]
+    
+    def close(self):
+        self.connection.close()
+
+class ResourceBlocker:
+    """Профиль блокировки запросов через route: картинки, медиа, шрифты и счетчики
+    
+    Ресурсы, которые нужны интерфейсу, пропускаются по списку allowlist
+    (подстроки URL). Включенный route отключает HTTP-кэш браузера, поэтому
+    профиль выключен по умолчанию. Размер заблокированного ответа неизвестен:
+    экономия оценивается по среднему размеру загруженных ответов того же типа
+    ресурса, для типов без загруженных ответов выводится только число запросов.
+    """
+    
+    def __init__(self, allowlist=()):
+        self.allowlist = tuple(allowlist)
+        # Тип ресурса -> [ответов, байт] за все время работы, для средних размеров
+        self.loaded_sizes = {}
+        self.reset()
+    
+    def reset(self):
+        self.blocked = {}
+        self.blocked_types = {}
+        self.allowed = 0
+        self.bytes_loaded = 0
+    
+    async def install(self, context):
+        """Подключение к контексту браузера: действует на все его вкладки"""
+        # При переподключении к тому же браузеру обработчик не должен задвоиться
+        await context.unroute("**/*", self._handle)
+        await context.route("**/*", self._handle)
+        context.remove_listener("requestfinished", self._on_request_finished)
+        context.on("requestfinished", self._on_request_finished)
+        print("🛡️  Блокирую картинки, медиа, шрифты и сторонние счетчики")
+    
+    async def _handle(self, route):
+        request = route.request
+        url = request.url
+        resource_type = request.resource_type
+        
+        if not any(allowed in url for allowed in self.allowlist):
+            if resource_type in BLOCKED_RESOURCE_TYPES:
+                reason = resource_type
+            elif any(marker in url for marker in BLOCKED_URL_MARKERS):
+                reason = "счетчики"
+            else:
+                reason = None
+            if reason:
+                self.blocked[reason] = self.blocked.get(reason, 0) + 1
+                self.blocked_types[resource_type] = self.blocked_types.get(resource_type, 0) + 1
+                await route.abort("blockedbyclient")
+                return
+        
+        self.allowed += 1
+        await route.continue_()
+    
+    async def _on_request_finished(self, request):
+        """Фактический размер ответа, в том числе без Content-Length (chunked, сжатие)"""
+        try:
+            sizes = await request.sizes()
+        except Exception:
+            return
+        size = sizes['responseBodySize'] + sizes['responseHeadersSize']
+        self.bytes_loaded += size
+        stats = self.loaded_sizes.setdefault(request.resource_type, [0, 0])
+        stats[0] += 1
+        stats[1] += size
+    
+    def estimate_saved(self):
+        """Оценка сэкономленных байт и типы ресурсов, для которых оценки нет"""
+        saved = 0
+        unknown = []
+        for resource_type, count in self.blocked_types.items():
+            responses, size = self.loaded_sizes.get(resource_type, (0, 0))
+            if responses:
+                saved += count * size / responses
+            else:
+                unknown.append(resource_type)
+        return saved, unknown
+    
+    def report(self):
+        blocked = sum(self.blocked.values())
+        details = ", ".join(f"{reason}: {count}" for reason, count in self.blocked.items())
+        print(f"🛡️  Заблокировано запросов: {blocked}" + (f" ({details})" if details else ""))
+        saved, unknown = self.estimate_saved()
+        estimate = f"Сэкономлено ≈ {saved / 1024:.0f} КБ"
+        if unknown:
+            estimate += f" (без оценки размера: {', '.join(unknown)})"
+        print(f"🛡️  {estimate}; пропущено запросов: {self.allowed}, загружено {self.bytes_loaded / 1024:.0f} КБ")
+
+class LookupIndex:
+    """Неизменяемый индекс собранных товаров для справочного сервиса
+    
+    Ответы по штрихкоду и ячейке готовятся в JSON при построении, поэтому
+    запрос сводится к поиску в словаре. Поиск по началу штрихкода идет
+    бинарным поиском по отсортированному списку штрихкодов.
+    """
+    __slots__ = ('records', 'by_barcode', 'by_cell', 'barcodes', 'flows', 'built_at')
+    
+    def __init__(self, items_by_flow=None):
+        records = {}
+        by_cell = {}
+        self.flows = {}
+        for flow_type, items_data in (items_by_flow or {}).items():
+            self.flows[flow_type] = len(items_data)
+            for item in items_data:
+                record = {
+                    'barcode': item['Штрихкод'],
+                    'cell': item['Ячейка'],
+                    'name': item['Название'],
+                    'flow_type': flow_type,
+                    'lock_status': item['Статус_блокировки'],
+                    'shipment': item.get('Перевозка', ""),
+                    'point': item.get('Пункт', ""),
+                }
+                by_cell.setdefault(record['cell'], []).append(record)
+                # Товары без штрихкода находятся только по ячейке
+                if record['barcode'] and record['barcode'] != "Не найден":
+                    records[record['barcode']] = record
+        
+        self.records = records
+        self.barcodes = sorted(records)
+        self.by_barcode = {barcode: self.encode(record) for barcode, record in records.items()}
+        self.by_cell = {cell: self.encode(cell_records) for cell, cell_records in by_cell.items()}
+        self.built_at = datetime.now().isoformat(timespec='seconds')
+    
+    @staticmethod
+    def encode(value):
+        return json.dumps(value, ensure_ascii=False).encode('utf-8')
+    
+    def prefix(self, prefix, limit=50):
+        """Товары, штрихкод которых начинается с prefix"""
+        result = []
+        for position in range(bisect.bisect_left(self.barcodes, prefix), len(self.barcodes)):
+            barcode = self.barcodes[position]
+            if not barcode.startswith(prefix) or len(result) >= limit:
+                break
+            result.append(self.records[barcode])
+        return result
+
+class LookupService:
+    """Локальный HTTP-сервис 'в какой ячейке штрихкод' по последним собранным товарам
+    
+    GET /barcode/<штрихкод>, /prefix/<начало штрихкода>?limit=N, /cell/<ячейка>,
+    /health. Работает на asyncio без браузера; после каждого сбора индекс
+    строится заново в отдельном потоке и подменяется одним присваиванием,
+    так что запрос видит либо старый, либо новый индекс целиком.
+    """
+    
+    REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}
+    
+    def __init__(self, port=8080, host="127.0.0.1"):
+        self.port = port
+        self.host = host
+        self.items_by_flow = {}
+        self.index = LookupIndex()
+        self.server = None
+    
+    async def update(self, flow_type, items_data):
+        """Замена товаров одного типа потока и перестроение индекса"""
+        items_by_flow = {**self.items_by_flow, flow_type: list(items_data)}
+        index = await asyncio.to_thread(LookupIndex, items_by_flow)
+        self.items_by_flow = items_by_flow
+        self.index = index
+        print(f"🔎 Справочный индекс обновлен: {len(index.records)} штрихкодов")
+    
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        print(f"🔎 Справочный сервис: http://{self.host}:{self.port}/barcode/<штрихкод>")
+    
+    async def serve_forever(self):
+        print("🔎 Сбор завершен, справочный сервис работает до Ctrl+C")
+        await self.server.serve_forever()
+    
+    async def close(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+    
+    async def _handle_connection(self, reader, writer):
+        """Соединение HTTP/1.1 с keep-alive: сканер шлет запросы подряд без переподключения"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                keep_alive = request_line.rstrip().endswith(b"HTTP/1.1")
+                content_length = 0
+                while True:
+                    header = await reader.readline()
+                    if header in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = header.decode('latin-1').partition(":")
+                    name = name.strip().lower()
+                    if name == "connection":
+                        keep_alive = "close" not in value.lower()
+                    elif name == "content-length":
+                        try:
+                            content_length = int(value)
+                        except ValueError:
+                            content_length = -1
+                    elif name == "transfer-encoding":
+                        # Границу тела не разбираем - после ответа соединение закрывается
+                        keep_alive = False
+                
+                # Тело запроса не нужно, но его надо дочитать, иначе оно станет началом следующего запроса
+                if content_length > 0:
+                    await reader.readexactly(content_length)
+                
+                try:
+                    method, target, _ = request_line.decode('latin-1').split(" ", 2)
+                    if content_length < 0:
+                        raise ValueError(content_length)
+                except ValueError:
+                    status, body = 400, self.index.encode({'error': "bad request"})
+                    keep_alive = False
+                else:
+                    status, body = self.route(method, target)
+                
+                writer.write(
+                    f"HTTP/1.1 {status} {self.REASONS[status]}\r\n"
+                    f"Content-Type: application/json; charset=utf-8\r\n"
+                    f"Content-Length: {len(body)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + body
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+    
+    def route(self, method, target):
+        """Ответ на запрос: (код, тело в JSON)"""
+        index = self.index
+        if method != "GET":
+            return 405, index.encode({'error': "only GET is supported"})
+        
+        path, _, query = target.partition("?")
+        endpoint, _, value = path.strip("/").partition("/")
+        value = urllib.parse.unquote(value)
+        
+        if endpoint == "barcode" and value:
+            body = index.by_barcode.get(value)
+        elif endpoint == "cell" and value:
+            body = index.by_cell.get(value)
+        elif endpoint == "prefix" and value:
+            try:
+                limit = int(urllib.parse.parse_qs(query).get('limit', ['50'])[0])
+            except ValueError:
+                return 400, index.encode({'error': "limit must be a number"})
+            body = index.encode(index.prefix(value, limit))
+        elif endpoint == "health":
+            body = index.encode({'status': "ok", 'items': sum(index.flows.values()), 'barcodes': len(index.records),
+                                 'flows': index.flows, 'built_at': index.built_at})
+        else:
+            return 404, index.encode({'error': "unknown endpoint"})
+        
+        if body is None:
+            return 404, index.encode({'error': "not found", endpoint: value})
+        return 200, body
+
+class RunMetrics:
+    """Замеры запуска по этапам: время, вызовы Playwright, таймауты, скорость извлечения
+    
+    Этап задается контекстом (with metrics.stage(...)) и хранится в
+    ContextVar, поэтому параллельные вкладки учитываются каждая в своем этапе.
+    """
+    
+    # Этапы в порядке вывода
+    STAGES = ('connect', 'navigate', 'flow_select', 'block_find', 'extract', 'save')
+    
     def __init__(self):
+        self._stage = contextvars.ContextVar('stage', default='other')
+        self.reset()
+    
+    def reset(self):
+        self.stages = {}
+        self.started_at = datetime.now()
+    
+    def _stats(self, name):
+        if name not in self.stages:
+            self.stages[name] = {'seconds': 0.0, 'runs': 0, 'calls': 0, 'timeouts': 0, 'items': 0}
+        return self.stages[name]
+    
+    @contextlib.contextmanager
+    def stage(self, name):
+        token = self._stage.set(name)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            stats = self._stats(name)
+            stats['seconds'] += time.perf_counter() - started
+            stats['runs'] += 1
+            self._stage.reset(token)
+    
+    def count_call(self):
+        self._stats(self._stage.get())['calls'] += 1
+    
+    def count_timeout(self):
+        self._stats(self._stage.get())['timeouts'] += 1
+    
+    def add_items(self, count):
+        self._stats(self._stage.get())['items'] += count
+    
+    async def track(self, awaitable):
+        """Учет одного асинхронного вызова Playwright"""
+        self.count_call()
+        try:
+            return _instrument(await awaitable, self)
+        except PlaywrightTimeoutError:
+            self.count_timeout()
+            raise
+    
+    def ordered_stages(self):
+        names = [name for name in self.STAGES if name in self.stages]
+        return names + [name for name in self.stages if name not in self.STAGES]
+    
+    def items_per_second(self):
+        extract = self.stages.get('extract')
+        if not extract or not extract['seconds']:
+            return 0.0
+        return extract['items'] / extract['seconds']
+    
+    def to_dict(self):
+        return {
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'stages': {name: dict(self.stages[name]) for name in self.ordered_stages()},
+            'items_per_second': self.items_per_second(),
+        }
+    
+    def to_prometheus(self):
+        """Текстовый формат Prometheus (для textfile collector)"""
+        metrics = [
+            ('ozon_pvz_stage_seconds', "Суммарное время этапа, с", 'seconds'),
+            ('ozon_pvz_stage_runs', "Сколько раз выполнялся этап", 'runs'),
+            ('ozon_pvz_stage_calls', "Вызовы Playwright/CDP за этап", 'calls'),
+            ('ozon_pvz_stage_timeouts', "Таймауты за этап", 'timeouts'),
+        ]
+        lines = []
+        for metric, help_text, key in metrics:
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} gauge")
+            for name in self.ordered_stages():
+                lines.append(f'{metric}{{stage="{name}"}} {self.stages[name][key]}')
+        lines.append("# HELP ozon_pvz_extract_items_per_second Скорость извлечения товаров")
+        lines.append("# TYPE ozon_pvz_extract_items_per_second gauge")
+        lines.append(f"ozon_pvz_extract_items_per_second {self.items_per_second():.3f}")
+        return "\n".join(lines) + "\n"
+    
+    def summary_table(self):
+        lines = [
+            f"{'Этап':<14}{'Время, с':>10}{'Раз':>6}{'Вызовов':>9}{'Таймаутов':>11}{'Товаров':>9}",
+            "-" * 59,
+        ]
+        for name in self.ordered_stages():
+            stats = self.stages[name]
+            lines.append(f"{name:<14}{stats['seconds']:>10.2f}{stats['runs']:>6}{stats['calls']:>9}"
+                         f"{stats['timeouts']:>11}{stats['items']:>9}")
+        lines.append("-" * 59)
+        lines.append(f"Скорость извлечения: {self.items_per_second():.1f} товаров/с")
+        return "\n".join(lines)
+    
+    def export(self):
+        """Сохранение в JSON (по запуску) и в results/metrics.prom (последний запуск)"""
+        json_filename = report_base_filename("run", prefix="metrics") + ".json"
+        with open(json_filename, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+        with open("results/metrics.prom", 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus())
+        return json_filename
+
+class BudgetExceeded(Exception):
+    """Срок запуска исчерпан; partial - товары, собранные до остановки, по типам потоков"""
+    
+    def __init__(self, stage, partial=None):
+        super().__init__(f"срок запуска исчерпан на этапе '{stage}'")
+        self.stage = stage
+        self.partial = partial if partial is not None else {}
+
+class RunBudget:
+    """Общий срок запуска, разделенный между этапами
+    
+    Этап получает долю оставшегося времени пропорционально своей доле среди
+    этого и следующих этапов, поэтому время, не израсходованное ранними
+    этапами, переходит к поздним, а на сохранение всегда остается запас.
+    Внутри этапа все вызовы Playwright ограничены его сроком: таймаут вкладки
+    по умолчанию и явные таймауты урезаются до остатка (OzonPvzBot._timeout),
+    а по истечении срока этап отменяется и поднимается BudgetExceeded.
+    """
+    
+    # Таймаут вкладки Playwright по умолчанию, мс
+    PLAYWRIGHT_DEFAULT_TIMEOUT = 30000
+    
+    # Доли этапов в порядке RunMetrics.STAGES
+    SHARES = {'connect': 0.15, 'navigate': 0.2, 'flow_select': 0.1, 'block_find': 0.15, 'extract': 0.3, 'save': 0.1}
+    
+    def __init__(self, seconds, shares=None):
+        self.seconds = seconds
+        self.shares = {**self.SHARES, **(shares or {})}
+        self._stage_deadline = contextvars.ContextVar('stage_deadline', default=None)
+        self._page_timeouts = {}
+        self.start()
+    
+    def start(self):
+        """Отсчет срока с текущего момента (в фоновом режиме - с начала цикла)"""
+        self.deadline = time.perf_counter() + self.seconds
+    
+    def remaining(self):
+        return self.deadline - time.perf_counter()
+    
+    def allot(self, name):
+        """Срок этапа, с"""
+        remaining = self.remaining()
+        if name not in self.shares:
+            return remaining
+        stages = list(self.shares)
+        later = sum(self.shares[stage] for stage in stages[stages.index(name):])
+        return remaining * self.shares[name] / later
+    
+    def clamp(self, timeout):
+        """Таймаут Playwright, мс, не дальше срока текущего этапа (или всего запуска вне этапов)"""
+        deadline = self._stage_deadline.get() or self.deadline
+        # 0 у Playwright означает 'без ограничения'
+        return max(1, min(timeout, int((deadline - time.perf_counter()) * 1000)))
+    
+    @contextlib.asynccontextmanager
+    async def stage(self, name, page=None):
+        seconds = self.allot(name)
+        if seconds <= 0:
+            raise BudgetExceeded(name)
+        token = self._stage_deadline.set(time.perf_counter() + seconds)
+        # Getter у Playwright нет: прежний таймаут вкладки помним сами и возвращаем после этапа
+        if page is not None:
+            previous = self._page_timeouts.get(page, self.PLAYWRIGHT_DEFAULT_TIMEOUT)
+            self._set_page_timeout(page, seconds * 1000)
+        timeout = asyncio.timeout(seconds)
+        try:
+            async with timeout:
+                yield
+        except TimeoutError:
+            if timeout.expired():
+                print(f"⏰ Этап '{name}' не уложился в {seconds:.1f} с")
+                raise BudgetExceeded(name) from None
+            raise
+        finally:
+            self._stage_deadline.reset(token)
+            if page is not None and not page.is_closed():
+                self._set_page_timeout(page, previous)
+    
+    def _set_page_timeout(self, page, timeout):
+        page.set_default_timeout(timeout)
+        self._page_timeouts[page] = timeout
+
+class InstrumentedProxy:
+    """Обертка над объектом Playwright, считающая вызовы и таймауты в RunMetrics
+    
+    Возвращаемые объекты Playwright (вкладки, элементы, локаторы) оборачиваются
+    так же, аргументы перед передачей в Playwright разворачиваются.
+    """
+    __slots__ = ('_target', '_metrics')
+    
+    def __init__(self, target, metrics):
+        object.__setattr__(self, '_target', target)
+        object.__setattr__(self, '_metrics', metrics)
+    
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr):
+            return _instrument(attr, self._metrics)
+        
+        def call(*args, **kwargs):
+            args = [_uninstrument(arg) for arg in args]
+            kwargs = {key: _uninstrument(value) for key, value in kwargs.items()}
+            result = attr(*args, **kwargs)
+            if inspect.isawaitable(result):
+                return self._metrics.track(result)
+            return _instrument(result, self._metrics)
+        return call
+    
+    def __setattr__(self, name, value):
+        setattr(self._target, name, value)
+    
+    def __eq__(self, other):
+        return self._target == _uninstrument(other)
+    
+    def __hash__(self):
+        return hash(self._target)
+    
+    def __repr__(self):
+        return f"InstrumentedProxy({self._target!r})"
+
+def _instrument(value, metrics):
+    if isinstance(value, list):
+        return [_instrument(entry, metrics) for entry in value]
+    if type(value).__module__.startswith("playwright.") and not isinstance(value, InstrumentedProxy):
+        return InstrumentedProxy(value, metrics)
+    return value
+
+def _uninstrument(value):
+    if isinstance(value, InstrumentedProxy):
+        return object.__getattribute__(value, '_target')
+    if isinstance(value, (list, tuple)):
+        return type(value)(_uninstrument(entry) for entry in value)
+    return value
+
+class OzonPvzBot:
+    # Верхние границы ожиданий готовности страницы, мс
+    WAIT_TIMEOUTS = {
+        'cdp': 15000,          # отладочный порт Edge отвечает
+        'page': 10000,         # документ загружен
+        'menu': 5000,          # подменю 'Отправка перевозок' отрисовано
+        'flow_types': 10000,   # список типов потоков отрисован
+        'blocks': 10000,       # блоки _block_4j0aa_1 появились
+        'items_stable': 5000,  # количество товаров перестало меняться
+    }
+    
+    def __init__(self, cdp_url="http://localhost:9222", wait_timeouts=None, api_dump_dir=None, interactive=True,
+                 diff_mode=False, selector_cache_file="selector_cache.json", scroll_harvest=False,
+                 output_formats=("xlsx", "txt"), user_data_dir="./edge_profile", browser_path=None,
+                 browser_args=(), kill_existing_edge=True, profile=False, resource_blocker=None, history=None,
+                 lookup=None, budget=None, started_at=None):
         self.browser = None
         self.page = None
         self.playwright = None
+        self.cdp_url = cdp_url
+        self.user_data_dir = user_data_dir
+        self.browser_path = browser_path
+        self.browser_args = list(browser_args)
+        self.kill_existing_edge = kill_existing_edge
+        self.profile = profile
+        self.resource_blocker = resource_blocker
+        self.history = history
+        self.lookup = lookup
+        self.budget = budget
+        self.metrics = RunMetrics()
+        self._watch_queue = None
+        # Ожидание оператора в input() срок запуска прервать не может
+        self.interactive = interactive and budget is None
+        # Отметка time.perf_counter() после диалогов запуска; от нее считается время до готовой вкладки
+        self.started_at = started_at
+        self.startup_seconds = None
+        self.wait_timeouts = {**self.WAIT_TIMEOUTS, **(wait_timeouts or {})}
+        self.api_dump_dir = api_dump_dir
+        self.api_payloads = []
+        self._api_tasks = []
+        self.diff_mode = diff_mode
+        self.scroll_harvest = scroll_harvest
+        self.output_formats = tuple(output_formats)
+        self.fingerprint_caches = {}
+        self.selector_cache_file = selector_cache_file
+        self.selector_cache = self._load_selector_cache()
     
     def find_opened_edge_windows(self):
         """Поиск открытых окон Edge с turbo-pvz.ozon.ru"""
         print("🔍 Ищу открытые окна Microsoft Edge...")
         
+        # Медленный перебор всех процессов; для подключения используется probe_cdp_endpoint
+        import psutil
+        
         try:
             # Получаем список всех процессов Edge
             edge_processes = []
@@ -48,68 +1416,98 @@ class OzonPvzBot:
             print(f"❌ Ошибка при поиске процессов: {e}")
             return False
     
+    def probe_cdp_endpoint(self, attempts=3, timeout=1.0):
+        """Проверка отладочного порта через /json/version и /json/list
+        
+        Возвращает None, только если порт отказывает в соединении (Edge с
+        отладкой не запущен), иначе адрес вкладки turbo-pvz.ozon.ru. Пустая
+        строка - такой вкладки нет или занятый Edge не успел ответить за
+        attempts попыток: подключение через CDP пробуется и в этом случае.
+        """
+        for attempt in range(attempts):
+            try:
+                with urllib.request.urlopen(f"{self.cdp_url}/json/version", timeout=timeout):
+                    pass
+                with urllib.request.urlopen(f"{self.cdp_url}/json/list", timeout=timeout) as response:
+                    targets = json.load(response)
+                break
+            except ValueError:
+                return ""
+            except OSError as e:
+                if isinstance(getattr(e, 'reason', e), ConnectionRefusedError):
+                    return None
+        else:
+            print(f"ℹ️  Отладочный порт {self.cdp_url} отвечает медленно, пробую подключиться через CDP")
+            return ""
+        
+        for target in targets:
+            if target.get('type') == "page" and "turbo-pvz.ozon.ru" in target.get('url', ""):
+                return target['url']
+        return ""
+
     async def connect_to_existing_edge(self):
+        """Подключение к существующему окну Edge с замером времени"""
+        started = time.perf_counter()
+        async with self.stage('connect'):
+            connected = await self._connect()
+        if not connected:
+            return False
+        # Время запуска - только для первого подключения, переподключения демона его не меняют
+        if self.started_at is not None and self.startup_seconds is None:
+            self.startup_seconds = time.perf_counter() - self.started_at
+            print(f"🚀 Подключение: {time.perf_counter() - started:.2f} с, "
+                  f"от запуска программы до готовой вкладки: {self.startup_seconds:.2f} с")
+        else:
+            print(f"🚀 Подключение: {time.perf_counter() - started:.2f} с")
+        return connected
+
+    async def _connect(self):
         """Подключение к существующему окну Edge"""
         print("🔗 Пытаюсь подключиться к существующему Edge...")
         
         self.playwright = await async_playwright().start()
+        if self.profile:
+            # Считаем все вызовы Playwright, начиная с подключения: браузер,
+            # вкладки и производные объекты оборачиваются при получении
+            self.playwright = InstrumentedProxy(self.playwright, self.metrics)
         
-        # Способ 1: Попробуем подключиться через CDP
-        try:
-            # Стандартный порт для отладки Edge
-            self.browser = await self.playwright.chromium.connect_over_cdp("http://localhost:9222")
-            contexts = self.browser.contexts
-            
-            if contexts:
-                for context in contexts:
-                    pages = context.pages
-                    if pages:
-                        for page in pages:
-                            if "turbo-pvz.ozon.ru" in page.url:
-                                self.page = page
-                                print("✅ Подключился к существующей вкладке turbo-pvz.ozon.ru")
-                                return True
-                
-                # Если не нашли нужную вкладку, используем первую доступную
-                self.page = contexts[0].pages[0] if contexts[0].pages else await contexts[0].new_page()
-                print("✅ Использую первую доступную вкладку")
-                return True
+        # Способ 1: Проверяем отладочный порт и подключаемся через CDP
+        target_url = await asyncio.to_thread(self.probe_cdp_endpoint)
+        if target_url is None:
+            print(f"ℹ️  Отладочный порт {self.cdp_url} не отвечает")
+        else:
+            try:
+                self.browser = await self.playwright.chromium.connect_over_cdp(self.cdp_url)
+                contexts = self.browser.contexts
                 
-        except Exception as e:
-            print(f"❌ Не удалось подключиться через CDP: {e}")
+                if contexts:
+                    pages = [page for context in contexts for page in context.pages]
+                    # Вкладка, найденная через /json/list, затем любая с turbo-pvz.ozon.ru
+                    for page in sorted(pages, key=lambda page: page.url != target_url):
+                        if "turbo-pvz.ozon.ru" in page.url:
+                            self.page = page
+                            print("✅ Подключился к существующей вкладке turbo-pvz.ozon.ru")
+                            return True
+                    
+                    # Если не нашли нужную вкладку, используем первую доступную
+                    self.page = contexts[0].pages[0] if contexts[0].pages else await contexts[0].new_page()
+                    print("✅ Использую первую доступную вкладку")
+                    return True
+                    
+            except Exception as e:
+                print(f"❌ Не удалось подключиться через CDP: {e}")
         
-        # Способ 2: Запускаем Edge с отладочным портом
-        print("🔄 Пробую запустить Edge с отладочным портом...")
-        try:
-            # Закрываем все предыдущие процессы Edge (осторожно!)
-            subprocess.run(['taskkill', '/f', '/im', 'msedge.exe'], capture_output=True)
-            time.sleep(2)
-            
-            # Запускаем Edge с отладочным портом
-            edge_path = r"C:\Program Files (x86)\Microsoft\Edge\Application\msedge.exe"
-            if not os.path.exists(edge_path):
-                edge_path = r"C:\Program Files\Microsoft\Edge\Application\msedge.exe"
-            
-            subprocess.Popen([
-                edge_path,
-                '--remote-debugging-port=9222',
-                '--user-data-dir=./edge_profile',
-                'https://turbo-pvz.ozon.ru/'
-            ])
-            
-            time.sleep(5)  # Ждем запуска
-            
-            # Подключаемся к новому экземпляру
-            self.browser = await self.playwright.chromium.connect_over_cdp("http://localhost:9222")
-            self.page = self.browser.contexts[0].pages[0] if self.browser.contexts[0].pages else await self.browser.contexts[0].new_page()
-            
-            print("✅ Запустил Edge с отладкой и подключился")
+        # Способ 2: Запускаем Edge с отладочным портом. Только если порт отказывает
+        # в соединении: иначе на нем работает Edge оператора, и перезапуск закрыл бы его
+        if target_url is not None:
+            print("ℹ️  Отладочный порт занят работающим Edge, перезапускать его не буду")
+        elif await self._launch_edge_with_debugging():
             return True
-            
-        except Exception as e:
-            print(f"❌ Не удалось запустить Edge с отладкой: {e}")
         
         # Способ 3: Ручное подключение
+        if not self.interactive:
+            return False
+        
         print("👆 Ручной режим подключения")
         print("Пожалуйста, выполните следующие шаги:")
         print("1. Убедитесь, что Microsoft Edge открыт")
@@ -137,6 +1535,49 @@ class OzonPvzBot:
             print(f"❌ Критическая ошибка: {e}")
             return False
     
+    async def _launch_edge_with_debugging(self):
+        """Запуск Edge с отладочным портом и подключение к нему"""
+        print("🔄 Пробую запустить Edge с отладочным портом...")
+        try:
+            # Закрываем все предыдущие процессы Edge (осторожно!)
+            # При работе с несколькими пунктами это закрыло бы браузеры соседей
+            # Без блокирующих вызовов: срок этапа (RunBudget) должен прерывать и это ожидание
+            if self.kill_existing_edge:
+                taskkill = await asyncio.create_subprocess_exec(
+                    'taskkill', '/f', '/im', 'msedge.exe',
+                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                )
+                await taskkill.wait()
+                await asyncio.sleep(2)
+            
+            # Запускаем Edge с отладочным портом
+            edge_path = self.browser_path or r"C:\Program Files (x86)\Microsoft\Edge\Application\msedge.exe"
+            if not os.path.exists(edge_path):
+                edge_path = r"C:\Program Files\Microsoft\Edge\Application\msedge.exe"
+            
+            port = urllib.parse.urlparse(self.cdp_url).port or 9222
+            subprocess.Popen([
+                edge_path,
+                f'--remote-debugging-port={port}',
+                f'--user-data-dir={self.user_data_dir}',
+                *self.browser_args,
+                'https://turbo-pvz.ozon.ru/'
+            ])
+            
+            # Ждем, пока отладочный порт начнет отвечать
+            await self.wait_until("Запуск Edge", self._cdp_endpoint_ready(), 'cdp')
+            
+            # Подключаемся к новому экземпляру
+            self.browser = await self.playwright.chromium.connect_over_cdp(self.cdp_url)
+            self.page = self.browser.contexts[0].pages[0] if self.browser.contexts[0].pages else await self.browser.contexts[0].new_page()
+            
+            print("✅ Запустил Edge с отладкой и подключился")
+            return True
+            
+        except Exception as e:
+            print(f"❌ Не удалось запустить Edge с отладкой: {e}")
+            return False
+    
     async def ensure_correct_page(self):
         """Убедиться, что мы на правильной странице"""
         current_url = self.page.url
@@ -144,25 +1585,94 @@ class OzonPvzBot:
         if "turbo-pvz.ozon.ru" not in current_url:
             print("🌐 Перехожу на turbo-pvz.ozon.ru...")
             await self.page.goto("https://turbo-pvz.ozon.ru/", wait_until="networkidle")
-            await self.page.wait_for_timeout(1000)
         
         # Проверяем авторизацию
         if "auth" in self.page.url.lower() or "login" in self.page.url.lower():
             print("❌ Требуется авторизация!")
             print("Пожалуйста, войдите в аккаунт в открытом браузере")
+            if not self.interactive:
+                return False
             input("Нажмите Enter после авторизации...")
             await self.page.goto("https://turbo-pvz.ozon.ru/", wait_until="networkidle")
         
         print("✅ Страница готова к работе")
         return True
     
+    async def wait_until(self, label, condition, timeout_key):
+        """Ожидание условия готовности с логированием фактического времени"""
+        timeout = self._timeout(self.wait_timeouts[timeout_key]) / 1000
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(condition, timeout)
+            print(f"⏱️  {label}: {time.perf_counter() - started:.2f} с")
+            return True
+        except (asyncio.TimeoutError, PlaywrightTimeoutError) as e:
+            # Таймаут самого Playwright через InstrumentedProxy уже учтен в RunMetrics.track
+            if not (isinstance(e, PlaywrightTimeoutError) and isinstance(self.page, InstrumentedProxy)):
+                self.metrics.count_timeout()
+            print(f"⏱️  {label}: не дождался за {timeout:.0f} с")
+            return False
+    
+    @contextlib.asynccontextmanager
+    async def stage(self, name):
+        """Этап запуска: замер в RunMetrics и, если задан срок запуска, доля бюджета"""
+        with self.metrics.stage(name):
+            if self.budget is None:
+                yield
+                return
+            async with self.budget.stage(name, self.page):
+                yield
+    
+    def _timeout(self, default):
+        """Явный таймаут Playwright, мс, урезанный до остатка срока этапа"""
+        if self.budget is None:
+            return default
+        return self.budget.clamp(default)
+    
+    async def _cdp_endpoint_ready(self):
+        """Отладочный порт Edge отвечает на /json/version"""
+        def probe():
+            try:
+                with urllib.request.urlopen(f"{self.cdp_url}/json/version", timeout=1):
+                    return True
+            except OSError:
+                return False
+        
+        while not await asyncio.to_thread(probe):
+            await asyncio.sleep(0.2)
+    
+    async def _selector_visible(self, selector, timeout_key):
+        """Элемент по селектору отрисован и видим"""
+        await self.page.wait_for_selector(selector, state="visible", timeout=self._timeout(self.wait_timeouts[timeout_key]))
+    
+    async def _flow_list_state(self, flow_type, selector="div._block_4j0aa_1 div._element_16tx4_1"):
+        return await self.page.eval_on_selector_all(selector, FLOW_LIST_STATE_JS, flow_type)
+    
+    async def _flow_list_switched(self, flow_type, before, interval=0.1):
+        """После клика по типу потока: у всех карточек нужный тип потока или список изменился"""
+        while True:
+            state = await self._flow_list_state(flow_type)
+            if state['matches'] or state['signature'] != before['signature']:
+                return
+            await asyncio.sleep(interval)
+    
+    async def _items_stable(self, selector="div._block_4j0aa_1 div._element_16tx4_1", interval=0.3, rounds=2):
+        """Количество элементов по селектору не меняется несколько замеров подряд"""
+        previous = -1
+        stable = 0
+        while stable < rounds:
+            count = await self.page.eval_on_selector_all(selector, "elements => elements.length")
+            stable = stable + 1 if count == previous else 0
+            previous = count
+            await asyncio.sleep(interval)
+    
     #####################################################################################################################
     
     async def navigate_to_shipment_transport(self):
         """Переход в раздел Отправка -> Отправка перевозок"""
         print("📂 Ищу раздел 'Отправка'...")
         
-        await self.page.wait_for_timeout(2000)
+        await self.wait_until("Загрузка страницы", self.page.wait_for_load_state("domcontentloaded"), 'page')
         
         # Проверяем, не находимся ли уже в нужном разделе
         current_url = self.page.url
@@ -185,27 +1695,21 @@ class OzonPvzBot:
             "[class*='shipment']",
         ]
         
-        for selector in shipment_selectors:
-            try:
-                await self.page.click(selector, timeout=5000)
-                print(f"✅ Нажал на 'Отправка': {selector}")
-                await self.page.wait_for_timeout(3000)
-                
-                # После клика на Отправка, сразу ищем перевозки
-                return await self.select_shipment_transport()
-                        
-            except Exception as e:
-                continue
+        selector = await self.race_click('shipment', shipment_selectors)
+        if not selector:
+            print("❌ Раздел 'Отправка' не найден автоматически")
+            return False
         
-        print("❌ Раздел 'Отправка' не найден автоматически")
-        return False
+        print(f"✅ Нажал на 'Отправка': {selector}")
+        await self.wait_until("Подменю 'Отправка'", self._selector_visible("text=перевозок", 'menu'), 'menu')
+        
+        # После клика на Отправка, сразу ищем перевозки
+        return await self.select_shipment_transport()
 
     async def select_shipment_transport(self):
         """Выбор подпункта 'Отправка перевозок' после входа в Отправка"""
         print("🚚 Ищу подпункт 'Отправка перевозок'...")
         
-        await self.page.wait_for_timeout(1000)
-        
         transport_selectors = [
             "text=Отправка перевозок",
             "text=перевозок",
@@ -217,219 +1721,1087 @@ class OzonPvzBot:
             "a[href*=id=-1001]",
         ]
         
-        for selector in transport_selectors:
+        selector = await self.race_click('transport', transport_selectors)
+        if not selector:
+            print("❌ Подпункт 'Отправка перевозок' не найден автоматически")
+            return False
+        
+        print(f"✅ Нажал на 'Отправка перевозок': {selector}")
+        if await self.wait_until("Типы потоков", self._selector_visible("div._flowType_16tx4_203", 'flow_types'), 'flow_types'):
+            self.selector_cache['transport_url'] = self.page.url
+            self._save_selector_cache()
+        return True
+
+    async def race_click(self, name, selectors, timeout=5000, grace=0.15):
+        """Клик по первому видимому элементу из списка селекторов, проверяемых параллельно
+        
+        Сначала пробуется селектор, сработавший в прошлый раз. При гонке из
+        селекторов, ставших видимыми почти одновременно, выбирается стоящий
+        раньше в списке: общие селекторы вида div:has-text(...) находятся
+        мгновенно, но менее точны.
+        """
+        cached = self.selector_cache.get(name)
+        if cached in selectors:
             try:
-                await self.page.click(selector, timeout=5000)
-                print(f"✅ Нажал на 'Отправка перевозок': {selector}")
-                await self.page.wait_for_timeout(1000)
-                return True
-            except Exception as e:
-                continue
+                await self.page.click(cached, timeout=self._timeout(1500))
+                return cached
+            except Exception:
+                print(f"ℹ️  Сохраненный селектор '{cached}' не сработал, проверяю все варианты")
         
-        print("❌ Подпункт 'Отправка перевозок' не найден автоматически")
-        return False
+        async def visible(selector):
+            locator = self.page.locator(selector).first
+            await locator.wait_for(state="visible", timeout=self._timeout(timeout))
+            return locator
+        
+        tasks = {asyncio.ensure_future(visible(selector)): selector for selector in selectors}
+        try:
+            pending = set(tasks)
+            found = {}
+            deadline = None
+            while pending:
+                wait_timeout = None if deadline is None else max(0, deadline - time.perf_counter())
+                done, pending = await asyncio.wait(pending, timeout=wait_timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if not task.cancelled() and task.exception() is None:
+                        found[tasks[task]] = task.result()
+                if found and deadline is None:
+                    deadline = time.perf_counter() + grace
+                if found and (not done or time.perf_counter() >= deadline):
+                    break
+        finally:
+            for task in tasks:
+                task.cancel()
+        
+        for selector in selectors:
+            if selector not in found:
+                continue
+            try:
+                await found[selector].click(timeout=self._timeout(timeout))
+            except Exception:
+                continue
+            self.selector_cache[name] = selector
+            self._save_selector_cache()
+            return selector
+        return None
+
+    def _load_selector_cache(self):
+        """Селекторы меню и адрес страницы перевозок, сработавшие в прошлых запусках"""
+        try:
+            with open(self.selector_cache_file, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_selector_cache(self):
+        try:
+            with open(self.selector_cache_file, 'w', encoding='utf-8') as f:
+                json.dump(self.selector_cache, f, ensure_ascii=False, indent=2)
+        except OSError as e:
+            print(f"⚠️  Не удалось сохранить кэш селекторов: {e}")
 
     async def select_flow_type(self, flow_type):
         """Выбор типа потока"""
         print(f"🔘 Ищу тип потока: {flow_type}...")
         
-        await self.page.wait_for_timeout(2000)
+        await self.wait_until("Типы потоков", self._selector_visible("div._flowType_16tx4_203", 'flow_types'), 'flow_types')
+        
+        # Ищем все элементы с типами потоков
+        flow_elements = await self.page.query_selector_all("div._flowType_16tx4_203")
+        
+        before = None
+        for element in flow_elements:
+            try:
+                text = await element.text_content()
+                if flow_type in text:
+                    before = await self._flow_list_state(flow_type)
+                    await element.click()
+                    break
+            except Exception as e:
+                before = None
+                continue
+        
+        if before is None:
+            print(f"❌ Тип потока '{flow_type}' не найден автоматически")
+            return False
+        
+        # Клик прошел: ошибки ожиданий ниже не повод пробовать другую вкладку
+        print(f"✅ Выбрал: {flow_type}")
+        # Список прошлого потока (или пустой) уже стабилен: сначала ждем,
+        # что список сменился, и только потом - что он дорисовался
+        await self.wait_until("Смена списка товаров", self._flow_list_switched(flow_type, before), 'items_stable')
+        await self.wait_until("Содержимое потока", self._items_stable(), 'items_stable')
+        return True
+
+    async def find_target_blocks(self):
+        """Все блоки с информатором 'Добавьте содержимое в перевозку': список (перевозка, блок)
+        
+        Перевозка - номер из заголовка блока, если он есть, иначе порядковый
+        номер блока с информатором на странице (#1, #2, ...).
+        """
+        print("🔍 Ищу все блоки с информатором 'Добавьте содержимое в перевозку'...")
+        
+        await self.wait_until("Блоки перевозок", self._selector_visible("div._block_4j0aa_1", 'blocks'), 'blocks')
+        await self.wait_until("Стабилизация списка товаров", self._items_stable(), 'items_stable')
+        
+        # Блоки и номера перевозок берутся из одного вызова, затем из него же достаются элементы
+        found = await self.page.evaluate_handle(TARGET_BLOCKS_JS, ["div._block_4j0aa_1", TARGET_INFORMER])
+        try:
+            total, shipments = await found.evaluate("(found) => [found.total, found.shipments]")
+            blocks = await (await found.get_property("blocks")).get_properties()
+        finally:
+            await found.dispose()
+        print(f"✅ Найдено блоков _block_4j0aa_1: {total}")
+        
+        target_blocks = []
+        for position, shipment in enumerate(shipments):
+            block = blocks[str(position)].as_element()
+            target_blocks.append((shipment or f"#{position + 1}", block))
+        
+        if target_blocks:
+            print(f"✅ Найдено перевозок с информатором: {len(target_blocks)} "
+                  f"({', '.join(shipment for shipment, _ in target_blocks)})")
+        else:
+            print("❌ Не найден блок с информатором 'Добавьте содержимое в перевозку'")
+        return target_blocks
+
+    async def extract_shipments(self, target_blocks, cache=None, concurrency=4, partial=None):
+        """Одновременное извлечение товаров из нескольких перевозок, не больше concurrency сразу
+        
+        Товары помечаются перевозкой и собираются в один общий список. С
+        прокруткой (scroll_harvest) перевозки разбираются по одной. Кэш
+        отпечатков карточек рассчитан на один блок и при нескольких не используется.
+        В partial товары дописываются по мере готовности (перевозка целиком,
+        при прокрутке - каждая карточка): если сбор прерван, там остается собранное.
+        """
+        partial = ItemBatch() if partial is None else partial
+        
+        async def extract(block, shipment=""):
+            if not self.scroll_harvest:
+                items_data = await self.extract_items_before_locked_section(block, cache=cache)
+                if shipment:
+                    items_data.tag('shipment', shipment)
+                partial.extend(items_data)
+                return items_data
+            items_data = ItemBatch()
+            async for item in self.harvest_items(block):
+                item.shipment = shipment
+                items_data.append(item)
+                partial.append(item)
+            return items_data
+        
+        # Одна перевозка - отчет без колонки 'Перевозка', как раньше
+        if len(target_blocks) == 1:
+            return await extract(target_blocks[0][1])
+        
+        # Прокрутка идет у общего прокручиваемого предка блоков: одновременные
+        # прокрутки сбивали бы друг другу позицию, поэтому перевозки по очереди
+        semaphore = asyncio.Semaphore(1 if self.scroll_harvest else concurrency)
+        
+        async def extract_shipment(shipment, block):
+            async with semaphore:
+                items_data = await extract(block, shipment)
+            print(f"📦 Перевозка {shipment}: {len(items_data)} товаров")
+            return items_data
+        
+        results = await asyncio.gather(*(extract_shipment(shipment, block) for shipment, block in target_blocks))
+        
+        all_items = ItemBatch()
+        for items_data in results:
+            all_items.extend(items_data)
+        return all_items
+
+    async def extract_items_before_locked_section(self, target_block, batch=True, cache=None):
+        """Извлечение товаров, которые находятся ДО секции 'Не подходит направление потока'"""
+        print("📦 Ищу товары ДО секции 'Не подходит направление потока'...")
+        
+        if batch and cache is not None:
+            try:
+                return await self.extract_items_incremental(target_block, cache)
+            except Exception as e:
+                print(f"⚠️  Инкрементальное извлечение не удалось ({e}), разбираю все карточки")
+        
+        if batch:
+            try:
+                return await self.extract_items_batch(target_block)
+            except Exception as e:
+                print(f"⚠️  Пакетное извлечение не удалось ({e}), перехожу на поэлементный разбор")
+        
+        items_data = ItemBatch()
+        
+        try:
+            # Находим все элементы товаров в блоке
+            all_elements = await target_block.query_selector_all("div._element_16tx4_1")
+            print(f"✅ Найдено всех элементов товаров: {len(all_elements)}")
+            
+            # Парсим только незаблокированные товары
+            for i, element in enumerate(all_elements):
+                try:
+                    # Проверяем, заблокирован ли элемент
+                    is_locked = await element.query_selector("div._locked_16tx4_13") is not None
+                    
+                    if not is_locked:
+                        item_data = await self.parse_item(element, i, "требуется оформление")
+                        if item_data:
+                            items_data.append(item_data)
+                            print(f"✅ Добавлен товар: {item_data['Название'][:50]}...")
+                    
+                except Exception as e:
+                    print(f"❌ Ошибка парсинга элемента {i}: {e}")
+                    continue
+            
+            print(f"✅ Найдено незаблокированных товаров: {len(items_data)}")
+            
+        except Exception as e:
+            print(f"❌ Ошибка при извлечении товаров: {e}")
+        
+        return items_data
+
+    async def extract_items_batch(self, target_block):
+        """Извлечение всех карточек блока за один запрос к странице"""
+        raw_items = await target_block.eval_on_selector_all("div._element_16tx4_1", BATCH_EXTRACT_JS)
+        return self.items_from_raw(raw_items)
+
+    def items_from_shipments(self, shipments):
+        """Товары всех перевозок из списка (перевозка, сырые поля карточек)
+        
+        Как у extract_shipments: при одной перевозке товары не помечаются.
+        """
+        if len(shipments) == 1:
+            return self.items_from_raw(shipments[0][1])
+        all_items = ItemBatch()
+        for shipment, raw_items in shipments:
+            items_data = self.items_from_raw(raw_items)
+            items_data.tag('shipment', shipment)
+            print(f"📦 Перевозка {shipment}: {len(items_data)} товаров")
+            all_items.extend(items_data)
+        return all_items
+
+    def items_from_raw(self, raw_items):
+        """Незаблокированные товары из сырых полей карточек блока"""
+        print(f"✅ Найдено всех элементов товаров: {len(raw_items)}")
+        
+        items_data = ItemBatch()
+        for i, raw in enumerate(raw_items):
+            if raw['locked']:
+                continue
+            try:
+                item_data = self._make_item(raw, i, "требуется оформление")
+            except Exception as e:
+                print(f"❌ Ошибка парсинга элемента {i}: {e}")
+                continue
+            items_data.append(item_data)
+            print(f"✅ Добавлен товар: {item_data['Название'][:50]}...")
+        
+        print(f"✅ Найдено незаблокированных товаров: {len(items_data)}")
+        return items_data
+
+    async def extract_items_incremental(self, target_block, cache):
+        """Пакетное извлечение, при котором заново разбираются только изменившиеся карточки
+        
+        cache - словарь {отпечаток карточки: сырые поля}, после вызова содержит
+        только карточки, присутствующие в блоке сейчас
+        """
+        fingerprints = await target_block.eval_on_selector_all("div._element_16tx4_1", FINGERPRINTS_JS)
+        missing = [i for i, fingerprint in enumerate(fingerprints) if fingerprint not in cache]
+        
+        if missing:
+            parsed = await target_block.eval_on_selector_all("div._element_16tx4_1", SELECTED_EXTRACT_JS, missing)
+            for i, (fingerprint, raw) in zip(missing, parsed):
+                if fingerprint != fingerprints[i]:
+                    raise RuntimeError("содержимое блока изменилось во время разбора")
+                cache[fingerprint] = raw
+        
+        print(f"✅ Найдено всех элементов товаров: {len(fingerprints)} "
+              f"(разобрано заново: {len(missing)}, без изменений: {len(fingerprints) - len(missing)})")
+        
+        current = {fingerprint: cache[fingerprint] for fingerprint in fingerprints}
+        cache.clear()
+        cache.update(current)
+        
+        items_data = ItemBatch()
+        for i, fingerprint in enumerate(fingerprints):
+            raw = cache[fingerprint]
+            if not raw['locked']:
+                items_data.append(self._make_item(raw, i, "требуется оформление"))
+        
+        print(f"✅ Найдено незаблокированных товаров: {len(items_data)}")
+        return items_data
+
+    async def harvest_items(self, target_block, step=800, idle_rounds=3, seen_limit=5000):
+        """Потоковый сбор товаров с пошаговой прокруткой блока
+        
+        Для ленивой или виртуальной отрисовки списка: после каждого шага
+        прокрутки разбираются отрисованные карточки, новые товары сразу
+        отдаются вызывающему коду. Повторы отсекаются по штрихкоду, у карточек
+        без него - по отпечатку; помнятся только последние seen_limit ключей,
+        поэтому память не растет с длиной списка. Сбор заканчивается, когда
+        idle_rounds шагов подряд не дают новых карточек.
+        """
+        # Возвращаем контейнер в начало списка
+        await target_block.evaluate(SCROLL_BLOCK_JS, -10 ** 9)
+        
+        seen = OrderedDict()
+        index = 0
+        idle = 0
+        while idle < idle_rounds:
+            raw_items = await target_block.eval_on_selector_all("div._element_16tx4_1", BATCH_EXTRACT_JS)
+            new = 0
+            for raw in raw_items:
+                key = raw['barcode'] or raw['fingerprint']
+                if key in seen:
+                    seen.move_to_end(key)
+                    continue
+                seen[key] = None
+                if len(seen) > seen_limit:
+                    seen.popitem(last=False)
+                
+                new += 1
+                index += 1
+                if not raw['locked']:
+                    yield self._make_item(raw, index - 1, "требуется оформление")
+            
+            at_bottom = await target_block.evaluate(SCROLL_BLOCK_JS, step)
+            idle = idle + 1 if new == 0 else 0
+            if at_bottom and new == 0:
+                break
+            
+            # Даем списку дорисовать карточки после прокрутки
+            try:
+                await asyncio.wait_for(self._items_stable(interval=0.1, rounds=2), 2)
+            except asyncio.TimeoutError:
+                pass
+        
+        print(f"✅ Прокруткой просмотрено карточек: {index}")
+
+    async def parse_item(self, item_element, index, status):
+        """Парсинг карточки товара"""
+        try:
+            async def text(selector):
+                element = await item_element.query_selector(selector)
+                return await element.text_content() if element else None
+            
+            raw = {
+                'name': await text("div._titleWrap_1ailj_14"),
+                'barcode': await text("div._barcode_1ailj_7"),
+                'location': await text("div._address_1ailj_28 .ozi__badge__label__Rb41r"),
+                'flow_type': await text("div._flowType_16tx4_203"),
+                'color': await text("div._flex_lxoww_1 div:last-child"),
+                'content': await text("div._content_1ailj_36"),
+                'locked': await item_element.query_selector("div._locked_16tx4_13") is not None,
+            }
+            return self._make_item(raw, index, status)
+        except Exception as e:
+            print(f"❌ Ошибка парсинга элемента {index}: {e}")
+            return None
+
+    @staticmethod
+    def _make_item(raw, index, status):
+        """Сборка записи о товаре из сырых текстов карточки"""
+        # Название товара
+        name = raw['name'] if raw['name'] is not None else "Неизвестно"
+        
+        # Штрихкод
+        barcode_text = raw['barcode'] or ""
+        barcode = barcode_text.replace("Штрихкод:", "").strip() if barcode_text else "Не найден"
+        
+        # Местоположение (ячейка)
+        location = raw['location'] if raw['location'] is not None else "Не указано"
+        
+        # Тип потока
+        flow_type = raw['flow_type'] if raw['flow_type'] is not None else "Не определен"
+        
+        # Цвет (если есть)
+        color = raw['color'] or ""
+        
+        # Размер (если есть)
+        size = raw.get('size') or ""
+        content_text = raw.get('content')
+        if content_text and "Размер" in content_text:
+            size_parts = content_text.split("Размер")
+            if len(size_parts) > 1:
+                size = size_parts[1].strip().split('\n')[0]
+        
+        # Статус блокировки
+        lock_status = "Заблокирован" if raw['locked'] else "Доступен"
+        
+        return ShipmentItem(
+            index=index + 1,
+            name=name.strip(),
+            barcode=barcode,
+            cell=location,
+            flow_type=flow_type,
+            color=color.strip(),
+            size=size.strip(),
+            lock_status=lock_status,
+            status=status,
+        )
+
+    async def open_outbound_page(self):
+        """Переход на страницу 'Отправка перевозок' через меню или напрямую"""
+        # Известный по прошлым запускам адрес страницы перевозок: меню не нужно
+        transport_url = self.selector_cache.get('transport_url')
+        if transport_url:
+            print(f"🔗 Перехожу по сохраненному адресу: {transport_url}")
+            await self.page.goto(transport_url, wait_until="domcontentloaded")
+            if await self.wait_until("Типы потоков", self._selector_visible("div._flowType_16tx4_203", 'flow_types'), 'flow_types'):
+                return True
+            print("ℹ️  Сохраненный адрес не открыл страницу перевозок, иду через меню")
+            self.selector_cache.pop('transport_url')
+            self._save_selector_cache()
+        
+        # Шаг 1: Переход в Отправка -> Отправка перевозок
+        if not await self.navigate_to_shipment_transport():
+            print("❌ Не удалось перейти в раздел отправки перевозок")
+            
+            # Пробуем прямой переход
+            print("🔄 Пробую прямой переход на страницу перевозок...")
+            await self.page.goto("https://turbo-pvz.ozon.ru/outbound?id=-1000", wait_until="networkidle")
+            await self.wait_until("Типы потоков", self._selector_visible("div._flowType_16tx4_203", 'flow_types'), 'flow_types')
+            
+            # Проверяем, загрузилась ли страница
+            current_url = self.page.url
+            print(f"🌐 Текущий URL после прямого перехода: {current_url}")
+            
+            if "transport" not in current_url and "id=-1000" not in current_url:
+                print("❌ Прямой переход тоже не сработал")
+                return False
+        
+        # Проверяем, что мы действительно на странице перевозок
+        current_url = self.page.url
+        print(f"🌐 Текущий URL: {current_url}")
+        return True
+
+    async def collect_flow(self, flow_type):
+        """Выбор типа потока и сбор товаров по DOM страницы
+        
+        None - сбор не удался (нет вкладки потока или целевого блока),
+        пустой ItemBatch - блок действительно пуст.
+        """
+        # Шаг 2: Выбор типа потока
+        async with self.stage('flow_select'):
+            selected = await self.select_flow_type(flow_type)
+        if not selected:
+            print(f"❌ Не удалось выбрать тип потока '{flow_type}'")
+            return None
+        
+        # Шаг 3: Находим все блоки перевозок с информатором
+        async with self.stage('block_find'):
+            target_blocks = await self.find_target_blocks()
+        if not target_blocks:
+            print("❌ Не найден целевой блок")
+            return None
+        
+        # Шаг 4: Извлекаем товары ДО секции "Не подходит направление потока"
+        print("⏳ Загружаю данные о товарах ДО секции 'Не подходит направление потока'...")
+        partial = ItemBatch()
+        try:
+            async with self.stage('extract'):
+                cache = None
+                if self.diff_mode and not self.scroll_harvest and len(target_blocks) == 1:
+                    if flow_type not in self.fingerprint_caches:
+                        self.fingerprint_caches[flow_type] = self.load_snapshot(flow_type).get('fingerprints', {})
+                    cache = self.fingerprint_caches[flow_type]
+                items_data = await self.extract_shipments(target_blocks, cache=cache, partial=partial)
+                self.metrics.add_items(len(items_data))
+        except BudgetExceeded as e:
+            e.partial[flow_type] = partial
+            raise
+        return items_data
+
+    async def collect_flow_from_html(self, flow_type):
+        """Сбор товаров по HTML страницы: один запрос к браузеру, разбор в отдельном потоке
+        
+        Страница сохраняется в PAGE_SNAPSHOT_DIR, ее можно разобрать
+        повторно без браузера (--reparse).
+        """
+        async with self.stage('flow_select'):
+            selected = await self.select_flow_type(flow_type)
+        if not selected:
+            print(f"❌ Не удалось выбрать тип потока '{flow_type}'")
+            return None
+        
+        async with self.stage('block_find'):
+            await self.wait_until("Блоки перевозок", self._selector_visible("div._block_4j0aa_1", 'blocks'), 'blocks')
+            await self.wait_until("Стабилизация списка товаров", self._items_stable(), 'items_stable')
+        
+        async with self.stage('extract'):
+            html = await self.page.content()
+            snapshot_task = asyncio.create_task(asyncio.to_thread(save_page_snapshot, html, flow_type))
+            shipments = await asyncio.to_thread(parse_outbound_html, html)
+            print(f"💾 Страница сохранена: {await snapshot_task}")
+            if not shipments:
+                print("❌ Не найден блок с информатором 'Добавьте содержимое в перевозку'")
+                return None
+            items_data = self.items_from_shipments(shipments)
+            self.metrics.add_items(len(items_data))
+        return items_data
+
+    async def reparse_page_snapshots(self, path, default_flow_type=FLOW_TYPES[0], processes=None):
+        """Повторный разбор сохраненных страниц (файл или папка) без браузера
+        
+        Страницы разбираются параллельно в пуле процессов, результаты
+        публикуются как после обычного запуска.
+        """
+        if os.path.isdir(path):
+            filenames = sorted(glob.glob(os.path.join(path, "*.html.gz")) + glob.glob(os.path.join(path, "*.html")))
+        else:
+            filenames = [path]
+        if not filenames:
+            print(f"❌ В {path} нет сохраненных страниц")
+            return
         
-        # Ищем все элементы с типами потоков
-        flow_elements = await self.page.query_selector_all("div._flowType_16tx4_203")
+        print(f"🗂️  Разбираю сохраненных страниц: {len(filenames)}")
+        loop = asyncio.get_running_loop()
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            parsed = await asyncio.gather(*(
+                loop.run_in_executor(executor, parse_page_snapshot, filename) for filename in filenames
+            ))
         
-        for element in flow_elements:
-            try:
-                text = await element.text_content()
-                if flow_type in text:
-                    await element.click()
-                    print(f"✅ Выбрал: {flow_type}")
-                    await self.page.wait_for_timeout(2000)
-                    return True
-            except Exception as e:
+        for filename, shipments in zip(filenames, parsed):
+            flow_type = page_snapshot_flow_type(filename, default_flow_type)
+            print(f"\n📄 {filename} ({flow_type})")
+            if not shipments:
+                print("❌ Не найден блок с информатором 'Добавьте содержимое в перевозку'")
                 continue
-        
-        print(f"❌ Тип потока '{flow_type}' не найден автоматически")
-        return False
+            await self.publish(self.items_from_shipments(shipments), flow_type)
+
+    #####################################################################################################################
 
-    async def find_target_block_with_informer(self):
-        """Поиск блока с информатором 'Добавьте содержимое в перевозку'"""
-        print("🔍 Ищу блок с информатором 'Добавьте содержимое в перевозку'...")
+    def start_api_capture(self):
+        """Подписка на JSON-ответы бэкенда страницы отправки"""
+        self.api_payloads = []
+        self.page.on("response", self._on_api_response)
+        print("📡 Перехватываю ответы API страницы отправки")
+
+    def _on_api_response(self, response):
+        """Отбор ответов XHR/fetch, относящихся к отправке"""
+        if response.request.resource_type not in ("xhr", "fetch"):
+            return
+        if not any(marker in response.url.lower() for marker in API_URL_MARKERS):
+            return
+        self._api_tasks.append(asyncio.ensure_future(self._capture_api_response(response)))
+
+    async def _capture_api_response(self, response):
+        """Сохранение тела JSON-ответа"""
+        try:
+            payload = await response.json()
+        except Exception:
+            return
+        self.api_payloads.append({'url': response.url, 'payload': payload})
+
+    def dump_api_payloads(self, payloads, flow_type):
+        """Сохранение ответов API в подкаталог потока; имена уникальны между вкладками и циклами"""
+        flow_dir = os.path.join(self.api_dump_dir, flow_type.replace(' ', '_'))
+        os.makedirs(flow_dir, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        for i, entry in enumerate(payloads, 1):
+            filename = os.path.join(flow_dir, f"response_{stamp}_{i:03d}.json")
+            with open(filename, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False, indent=2)
+        print(f"💾 Ответы API сохранены в {flow_dir}")
+
+    async def collect_flow_from_api(self, flow_type):
+        """Выбор типа потока и сбор товаров из перехваченных ответов API"""
+        mark = len(self.api_payloads)
         
-        await self.page.wait_for_timeout(3000)
+        async with self.stage('flow_select'):
+            selected = await self.select_flow_type(flow_type)
+        if not selected:
+            print(f"❌ Не удалось выбрать тип потока '{flow_type}'")
+            return None
         
-        # Ищем все блоки с классом _block_4j0aa_1
-        blocks = await self.page.query_selector_all("div._block_4j0aa_1")
-        print(f"✅ Найдено блоков _block_4j0aa_1: {len(blocks)}")
+        async with self.stage('extract'):
+            await self.wait_until("Ответы API", self.page.wait_for_load_state("networkidle"), 'items_stable')
+            await asyncio.gather(*self._api_tasks)
+            self._api_tasks = []
+            print(f"✅ Перехвачено ответов API: {len(self.api_payloads)}")
+            
+            # Ответы после клика по типу потока относятся к выбранному потоку;
+            # если их нет (вкладка уже была выбрана), разбираем все перехваченные
+            payloads = self.api_payloads[mark:]
+            items_data = self.parse_api_payloads(payloads, flow_type)
+            if not items_data:
+                payloads = self.api_payloads
+                items_data = self.parse_api_payloads(payloads, flow_type)
+            if self.api_dump_dir:
+                self.dump_api_payloads(payloads, flow_type)
+            print(f"✅ Найдено незаблокированных товаров: {len(items_data)}")
+            self.metrics.add_items(len(items_data))
+        return items_data
+
+    def parse_api_payloads(self, payloads, flow_type):
+        """Сборка записей о товарах из JSON-ответов бэкенда"""
+        flow_names = {}
+        records = []
+        for entry in payloads:
+            self._walk_api_payload(entry['payload'], False, flow_names, records)
         
-        for i, block in enumerate(blocks):
-            try:
-                # Ищем информатор внутри блока
-                informer_text = await block.inner_text()
-                if "Добавьте содержимое в перевозку" in informer_text:
-                    print(f"✅ Найден целевой блок (блок #{i + 1}) с нужным информатором")
-                    return block
-            except Exception as e:
+        items_data = ItemBatch()
+        seen = set()
+        for i, (record, locked) in enumerate(records):
+            raw = {field: self._api_value(record, keys) for field, keys in API_ITEM_FIELDS.items()}
+            if raw['barcode'] and raw['barcode'] in seen:
                 continue
+            seen.add(raw['barcode'])
+            
+            # Тип потока может прийти идентификатором из списка типов потоков
+            raw['flow_type'] = flow_names.get(raw['flow_type'], raw['flow_type'])
+            if raw['flow_type'] and "поток" in raw['flow_type'] and flow_type not in raw['flow_type']:
+                continue
+            
+            raw['locked'] = locked or any(record.get(key) for key in API_ITEM_FIELDS['locked'])
+            if raw['locked']:
+                continue
+            items_data.append(self._make_item(raw, i, "требуется оформление"))
         
-        print("❌ Не найден блок с информатором 'Добавьте содержимое в перевозку'")
+        return items_data
+
+    def load_api_dump(self, dump_dir, flow_type):
+        """Разбор ранее сохраненных ответов API без браузера"""
+        # Ответы каждого потока лежат в своем подкаталоге; плоский каталог - старый формат
+        flow_dir = os.path.join(dump_dir, flow_type.replace(' ', '_'))
+        if os.path.isdir(flow_dir):
+            dump_dir = flow_dir
+        payloads = []
+        for filename in sorted(os.listdir(dump_dir)):
+            if filename.endswith(".json"):
+                with open(os.path.join(dump_dir, filename), encoding='utf-8') as f:
+                    payloads.append(json.load(f))
+        print(f"📂 Загружено ответов API: {len(payloads)}")
+        return self.parse_api_payloads(payloads, flow_type)
+
+    def _walk_api_payload(self, node, locked, flow_names, records):
+        """Рекурсивный поиск списков товаров и справочника типов потоков"""
+        if isinstance(node, dict):
+            for key, value in node.items():
+                group_locked = locked or self._is_locked_group_key(key)
+                self._walk_api_payload(value, group_locked, flow_names, records)
+        elif isinstance(node, list):
+            for entry in node:
+                if not isinstance(entry, dict):
+                    continue
+                if any(key in entry for key in API_ITEM_FIELDS['barcode']):
+                    records.append((entry, locked))
+                elif 'id' in entry and "поток" in str(entry.get('name', entry.get('title', ''))):
+                    flow_names[str(entry['id'])] = str(entry.get('name', entry.get('title')))
+                else:
+                    self._walk_api_payload(entry, locked, flow_names, records)
+
+    @staticmethod
+    def _is_locked_group_key(key):
+        """Ключ группы заблокированных товаров: маркер целым словом и без отрицания"""
+        tokens = [token.lower() for token in API_KEY_TOKEN_RE.findall(str(key))]
+        i = 0
+        while i < len(tokens):
+            if tokens[i] in API_KEY_NEGATIONS and i + 1 < len(tokens):
+                # notSuitable - сам маркер, notBlocked - его отрицание
+                if tokens[i] + tokens[i + 1] in API_LOCKED_GROUP_MARKERS:
+                    return True
+                i += 2
+                continue
+            if tokens[i] in API_LOCKED_GROUP_MARKERS:
+                return True
+            i += 1
+        return False
+
+    @staticmethod
+    def _api_value(record, keys):
+        """Значение первого найденного ключа в текстовом виде"""
+        for key in keys:
+            if key not in record or record[key] is None:
+                continue
+            value = record[key]
+            # Вложенные объекты вида {"id": ..., "name": ...}
+            if isinstance(value, dict):
+                value = value.get('name', value.get('title', value.get('id')))
+            return str(value) if value is not None else None
         return None
 
-    async def extract_items_before_locked_section(self, target_block):
-        """Извлечение товаров, которые находятся ДО секции 'Не подходит направление потока'"""
-        print("📦 Ищу товары ДО секции 'Не подходит направление потока'...")
+    #####################################################################################################################
+
+    async def prepare(self, flow_label, mode="dom"):
+        """Подключение и переход на страницу 'Отправка перевозок'"""
+        if self.budget:
+            self.budget.start()
+        if not await self.connect_to_existing_edge():
+            print("❌ Не удалось подключиться к Edge")
+            return False
         
-        items_data = []
+        print(f"🎯 Начинаю сбор данных для: {flow_label}")
+        print("📋 Этапы работы:")
+        print("1. Переход в 'Отправка'")
+        print("2. Выбор 'Отправка перевозок'")
+        print("3. Выбор типа потока")
+        print("4. Сбор товаров ДО секции 'Не подходит направление потока'")
         
-        try:
-            # Находим все элементы товаров в блоке
-            all_elements = await target_block.query_selector_all("div._element_16tx4_1")
-            print(f"✅ Найдено всех элементов товаров: {len(all_elements)}")
-            
-            # Парсим только незаблокированные товары
-            for i, element in enumerate(all_elements):
-                try:
-                    # Проверяем, заблокирован ли элемент
-                    is_locked = await element.query_selector("div._locked_16tx4_13") is not None
-                    
-                    if not is_locked:
-                        item_data = await self.parse_item(element, i, "требуется оформление")
-                        if item_data:
-                            items_data.append(item_data)
-                            print(f"✅ Добавлен товар: {item_data['Название'][:50]}...")
-                    
-                except Exception as e:
-                    print(f"❌ Ошибка парсинга элемента {i}: {e}")
-                    continue
+        if self.resource_blocker:
+            await self.resource_blocker.install(self.page.context)
+        
+        async with self.stage('navigate'):
+            # Убеждаемся, что на правильной странице
+            if not await self.ensure_correct_page():
+                print("❌ Не удалось перейти на нужную страницу")
+                return False
             
-            print(f"✅ Найдено незаблокированных товаров: {len(items_data)}")
+            if mode == "api":
+                self.start_api_capture()
             
-        except Exception as e:
-            print(f"❌ Ошибка при извлечении товаров: {e}")
-        
-        return items_data
+            return await self.open_outbound_page()
 
-    async def parse_item(self, item_element, index, status):
-        """Парсинг карточки товара"""
+    async def collect(self, flow_type, mode="dom"):
+        """Сбор товаров одного типа потока на текущей вкладке; None, если сбор не удался"""
+        if mode == "api":
+            return await self.collect_flow_from_api(flow_type)
+        if mode == "html":
+            return await self.collect_flow_from_html(flow_type)
+        return await self.collect_flow(flow_type)
+
+    def _with_page(self, page):
+        """Копия бота, работающая с другой вкладкой того же браузера"""
+        worker = copy.copy(self)
+        worker.page = page
+        worker.api_payloads = []
+        worker._api_tasks = []
+        worker._watch_queue = None
+        return worker
+
+    async def collect_flows_concurrently(self, flow_types, mode="dom"):
+        """Параллельный сбор нескольких типов потоков, каждый в своей вкладке"""
+        outbound_url = self.page.url
+        pages = [self.page]
+        for _ in flow_types[1:]:
+            pages.append(await self.page.context.new_page())
+        
+        async def collect_on_page(flow_type, page):
+            worker = self if page is self.page else self._with_page(page)
+            if worker is not self:
+                if mode == "api":
+                    worker.start_api_capture()
+                async with worker.stage('navigate'):
+                    await page.goto(outbound_url, wait_until="domcontentloaded")
+            return await worker.collect(flow_type, mode)
+        
         try:
-            # Название товара
-            name_element = await item_element.query_selector("div._titleWrap_1ailj_14")
-            name = await name_element.text_content() if name_element else "Неизвестно"
-            
-            # Штрихкод
-            barcode_element = await item_element.query_selector("div._barcode_1ailj_7")
-            barcode_text = await barcode_element.text_content() if barcode_element else ""
-            barcode = barcode_text.replace("Штрихкод:", "").strip() if barcode_text else "Не найден"
-            
-            # Местоположение (ячейка)
-            location_element = await item_element.query_selector("div._address_1ailj_28 .ozi__badge__label__Rb41r")
-            location = await location_element.text_content() if location_element else "Не указано"
-            
-            # Тип потока
-            flow_element = await item_element.query_selector("div._flowType_16tx4_203")
-            flow_type = await flow_element.text_content() if flow_element else "Не определен"
-            
-            # Цвет (если есть)
-            color_element = await item_element.query_selector("div._flex_lxoww_1 div:last-child")
-            color = await color_element.text_content() if color_element else ""
-            
-            # Размер (если есть)
-            size = ""
-            content_element = await item_element.query_selector("div._content_1ailj_36")
-            if content_element:
-                content_text = await content_element.text_content()
-                if "Размер" in content_text:
-                    size_parts = content_text.split("Размер")
-                    if len(size_parts) > 1:
-                        size = size_parts[1].strip().split('\n')[0]
-            
-            # Статус блокировки
-            is_locked = await item_element.query_selector("div._locked_16tx4_13") is not None
-            lock_status = "Заблокирован" if is_locked else "Доступен"
-            
-            return {
-                '№': index + 1,
-                'Название': name.strip(),
-                'Штрихкод': barcode,
-                'Ячейка': location,
-                'Тип_потока': flow_type,
-                'Цвет': color.strip(),
-                'Размер': size.strip(),
-                'Статус_блокировки': lock_status,
-                'Статус_оформления': status
-            }
-        except Exception as e:
-            print(f"❌ Ошибка парсинга элемента {index}: {e}")
-            return None
+            results = await asyncio.gather(
+                *(collect_on_page(flow_type, page) for flow_type, page in zip(flow_types, pages)),
+                return_exceptions=True,
+            )
+        finally:
+            for page in pages[1:]:
+                await page.close()
+        
+        items_by_flow = {}
+        exceeded = None
+        for flow_type, result in zip(flow_types, results):
+            if isinstance(result, BudgetExceeded):
+                exceeded = result
+                result = result.partial.get(flow_type, [])
+            elif isinstance(result, Exception):
+                print(f"❌ Ошибка сбора '{flow_type}': {result}")
+                result = None
+            items_by_flow[flow_type] = result
+        
+        # Остальные потоки успели собраться: отдаем их вместе с частичными
+        if exceeded:
+            raise BudgetExceeded(exceeded.stage, items_by_flow)
+        return items_by_flow
 
-    async def run(self, flow_type="Прямой поток"):
+    async def run(self, flow_type="Прямой поток", mode="dom"):
         """Основной метод"""
         try:
-            if not await self.connect_to_existing_edge():
-                print("❌ Не удалось подключиться к Edge")
+            if not await self.prepare(flow_type, mode):
                 return
             
-            print(f"🎯 Начинаю сбор данных для: {flow_type}")
-            print("📋 Этапы работы:")
-            print("1. Переход в 'Отправка'")
-            print("2. Выбор 'Отправка перевозок'")
-            print("3. Выбор типа потока")
-            print("4. Сбор товаров ДО секции 'Не подходит направление потока'")
+            # Прокрутку без сравнения с прошлым запуском пишем в файлы сразу по мере сбора
+            if self.scroll_harvest and not self.diff_mode and not self.lookup and mode == "dom":
+                await self.stream_flow(flow_type)
+                return
             
-            # Убеждаемся, что на правильной странице
-            if not await self.ensure_correct_page():
-                print("❌ Не удалось перейти на нужную страницу")
+            items_data = await self.collect(flow_type, mode)
+            if items_data is None:
                 return
             
-            # Шаг 1: Переход в Отправка -> Отправка перевозок
-            if not await self.navigate_to_shipment_transport():
-                print("❌ Не удалось перейти в раздел отправки перевозок")
-                
-                # Пробуем прямой переход
-                print("🔄 Пробую прямой переход на страницу перевозок...")
-                await self.page.goto("https://turbo-pvz.ozon.ru/outbound?id=-1000", wait_until="networkidle")
-                await self.page.wait_for_timeout(5000)
-                
-                # Проверяем, загрузилась ли страница
-                current_url = self.page.url
-                print(f"🌐 Текущий URL после прямого перехода: {current_url}")
-                
-                if "transport" not in current_url and "id=-1000" not in current_url:
-                    print("❌ Прямой переход тоже не сработал")
+            if not items_data:
+                print("❌ Не найдено товаров ДО заблокированной секции")
+                # Опустевший блок - тоже изменение: все товары прошлого снимка убраны
+                if not self.diff_mode:
                     return
             
-            # Проверяем, что мы действительно на странице перевозок
-            current_url = self.page.url
-            print(f"🌐 Текущий URL: {current_url}")
+            await self.publish(items_data, flow_type)
             
-            # Шаг 2: Выбор типа потока
-            if not await self.select_flow_type(flow_type):
-                print(f"❌ Не удалось выбрать тип потока '{flow_type}'")
+        except BudgetExceeded as e:
+            await self.save_partial_results(e)
+        except Exception as e:
+            print(f"❌ Ошибка: {e}")
+        finally:
+            await self.close()
+            self.report_metrics()
+            if self.resource_blocker:
+                self.resource_blocker.report()
+            print("✅ Работа завершена")
+
+    async def run_all_flows(self, flow_types=FLOW_TYPES, mode="dom"):
+        """Сбор всех типов потоков параллельно в одном браузере"""
+        try:
+            if not await self.prepare(", ".join(flow_types), mode):
                 return
             
-            # Шаг 3: Находим целевой блок с информатором
-            target_block = await self.find_target_block_with_informer()
-            if not target_block:
-                print("❌ Не найден целевой блок")
-                return
+            items_by_flow = await self.collect_flows_concurrently(list(flow_types), mode)
             
-            # Шаг 4: Извлекаем товары ДО секции "Не подходит направление потока"
-            print("⏳ Загружаю данные о товарах ДО секции 'Не подходит направление потока'...")
-            items_data = await self.extract_items_before_locked_section(target_block)
+            all_items = ItemBatch()
+            for flow_type, items_data in items_by_flow.items():
+                if items_data is None:
+                    continue
+                if not items_data:
+                    print(f"❌ '{flow_type}': не найдено товаров ДО заблокированной секции")
+                if items_data or self.diff_mode:
+                    await self.publish(items_data, flow_type, display=False)
+                all_items.extend(items_data)
             
-            if not items_data:
-                print("❌ Не найдено товаров ДО заблокированной секции")
+            if not all_items or self.diff_mode:
                 return
             
-            self.display_results(items_data, flow_type)
-            self.save_to_files(items_data, flow_type)
+            self.display_results(all_items, "Все потоки")
+            if not self.history:
+                await self.save_items(all_items, "Все потоки")
             
+        except BudgetExceeded as e:
+            await self.save_partial_results(e)
         except Exception as e:
             print(f"❌ Ошибка: {e}")
+        finally:
+            await self.close()
+            self.report_metrics()
+            if self.resource_blocker:
+                self.resource_blocker.report()
+            print("✅ Работа завершена")
+
+    async def collect_point(self, flow_types=FLOW_TYPES, mode="dom"):
+        """Сбор товаров указанных потоков без вывода в консоль (для координатора пунктов)"""
+        flow_types = list(flow_types)
+        try:
+            if not await self.prepare(", ".join(flow_types), mode):
+                return None
+            if len(flow_types) > 1:
+                return await self.collect_flows_concurrently(flow_types, mode)
+            return {flow_types[0]: await self.collect(flow_types[0], mode)}
+        finally:
+            await self.close()
+
+    def session_alive(self):
+        """Браузер подключен, вкладка открыта и не перенаправлена на авторизацию"""
+        if not self.browser or not self.browser.is_connected():
+            return False
+        if not self.page or self.page.is_closed():
+            return False
+        url = self.page.url.lower()
+        return "auth" not in url and "login" not in url
+
+    async def reset_session(self):
+        """Сброс разорванного подключения перед повторным подключением"""
+        print("🔌 Подключение к браузеру потеряно, переподключаюсь...")
+        try:
+            if self.playwright:
+                await self.playwright.stop()
+        except Exception as e:
+            print(f"⚠️  Предупреждение при сбросе подключения: {e}")
+        self.browser = None
+        self.page = None
+        self.playwright = None
+
+    async def run_daemon(self, flow_types=FLOW_TYPES, interval=300, mode="dom"):
+        """Фоновый режим: одно подключение и повторный сбор по расписанию"""
+        self.interactive = False
+        flow_types = list(flow_types)
+        cycle = 0
+        try:
+            while True:
+                cycle += 1
+                started = time.perf_counter()
+                print(f"\n🔁 Цикл #{cycle}: {datetime.now().strftime('%d.%m.%Y %H:%M:%S')}")
+                
+                self.metrics.reset()
+                if self.resource_blocker:
+                    self.resource_blocker.reset()
+                try:
+                    await self._daemon_cycle(flow_types, mode)
+                except BudgetExceeded as e:
+                    await self.save_partial_results(e)
+                except Exception as e:
+                    print(f"❌ Ошибка цикла: {e}")
+                    await self.reset_session()
+                self.report_metrics()
+                if self.resource_blocker:
+                    self.resource_blocker.report()
+                
+                elapsed = time.perf_counter() - started
+                print(f"⏱️  Цикл #{cycle}: {elapsed:.1f} с, следующий через {max(0, interval - elapsed):.0f} с")
+                await asyncio.sleep(max(0, interval - elapsed))
         finally:
             await self.close()
             print("✅ Работа завершена")
 
+    async def _daemon_cycle(self, flow_types, mode):
+        """Один цикл фонового режима"""
+        self.api_payloads = []
+        if self.budget:
+            self.budget.start()
+        
+        if self.session_alive() and "outbound" in self.page.url:
+            # Сессия жива: обновляем страницу перевозок вместо полной навигации
+            async with self.stage('navigate'):
+                await self.page.reload(wait_until="domcontentloaded")
+        else:
+            if self.playwright:
+                await self.reset_session()
+            if not await self.prepare(", ".join(flow_types), mode):
+                print("❌ Страница перевозок недоступна, повторю в следующем цикле")
+                return
+        
+        if len(flow_types) > 1:
+            items_by_flow = await self.collect_flows_concurrently(flow_types, mode)
+        else:
+            items_by_flow = {flow_types[0]: await self.collect(flow_types[0], mode)}
+        
+        for flow_type, items_data in items_by_flow.items():
+            # Сбой шага не должен выглядеть как опустевший блок: прошлые результаты не трогаем
+            if items_data is None:
+                print(f"⚠️  {flow_type}: сбор не удался, результаты прошлого цикла сохраняются")
+                continue
+            print(f"📊 {flow_type}: товаров ДО секции 'Не подходит направление потока': {len(items_data)}")
+            await self.publish(items_data, flow_type, display=False)
+
+    #####################################################################################################################
+
+    async def watch_flow(self, flow_type, stop_event=None, check_interval=5):
+        """Живое наблюдение за целевым блоком без повторного сбора
+        
+        Изменения приходят из страницы через MutationObserver; отчет
+        results/ozon_live_<поток>.* переписывается после каждой пачки.
+        Работает до stop_event или остановки оператором (Ctrl+C).
+        """
+        async with self.stage('flow_select'):
+            selected = await self.select_flow_type(flow_type)
+        if not selected:
+            print(f"❌ Не удалось выбрать тип потока '{flow_type}'")
+            return
+        
+        if self._watch_queue is None:
+            self._watch_queue = asyncio.Queue()
+            queue = self._watch_queue
+            await self.page.expose_binding("ozonPvzWatch", lambda source, changes: queue.put_nowait(changes))
+        
+        live = OrderedDict()
+        target_blocks = []
+        print(f"👀 Наблюдаю за '{flow_type}', остановка: Ctrl+C")
+        
+        while not (stop_event and stop_event.is_set()):
+            # Блок мог быть перерисован целиком: ищем все заново и снова подключаем наблюдатели
+            if not target_blocks or not await self._blocks_connected(target_blocks):
+                async with self.stage('block_find'):
+                    target_blocks = await self.find_target_blocks()
+                if not target_blocks:
+                    await asyncio.sleep(check_interval)
+                    continue
+                live.clear()
+                # При одной перевозке товары не помечаются, как в обычном сборе
+                batches = [
+                    await block.evaluate(WATCH_BLOCK_JS, ["ozonPvzWatch", shipment if len(target_blocks) > 1 else ""])
+                    for shipment, block in target_blocks
+                ]
+            else:
+                try:
+                    batches = [await asyncio.wait_for(self._watch_queue.get(), check_interval)]
+                except asyncio.TimeoutError:
+                    continue
+            
+            changed = [self._apply_watch_changes(live, changes) for changes in batches]
+            if any(changed):
+                print(f"📊 {flow_type}: товаров ДО секции 'Не подходит направление потока': {len(live)}")
+                async with self.stage('save'):
+                    await asyncio.to_thread(self._save_live_report, live, flow_type)
+                if self.lookup:
+                    await self.lookup.update(flow_type, live.values())
+
+    @staticmethod
+    async def _blocks_connected(target_blocks):
+        for _, block in target_blocks:
+            if not await block.evaluate("block => block.isConnected"):
+                return False
+        return True
+
+    def _apply_watch_changes(self, live, changes):
+        """Применение пачки изменений к текущему составу блоков; True, если состав изменился"""
+        changed = False
+        for kind, sign in (('removed', "-"), ('added', "+"), ('modified', "*")):
+            for raw in changes[kind]:
+                item = self._make_item(raw, 0, "требуется оформление")
+                item.shipment = changes['shipment']
+                key = raw['watchId']
+                mark = sign
+                # Карточка попала в секцию 'Не подходит направление потока' — из отчета убираем
+                if kind == 'removed' or raw['locked']:
+                    if live.pop(key, None) is None:
+                        continue
+                    mark = "-"
+                else:
+                    live[key] = item
+                changed = True
+                print(f"{mark} {datetime.now().strftime('%H:%M:%S')} {item['Штрихкод']} | {item['Ячейка']} | {item['Название'][:50]}")
+        return changed
+
+    def _save_live_report(self, live, flow_type):
+        """Перезапись живого отчета текущим составом блока"""
+        os.makedirs("results", exist_ok=True)
+        items_data = ItemBatch()
+        for position, item in enumerate(live.values(), 1):
+            item.index = position
+            items_data.append(item)
+        base_filename = f"results/ozon_live_{flow_type.replace(' ', '_')}"
+        for writer in open_writers(base_filename, flow_type, self.output_formats, item_report_columns(items_data)):
+            writer.write(items_data)
+            writer.close()
+
+    async def run_watch(self, flow_types, mode="dom"):
+        """Живое наблюдение за выбранными потоками, каждый в своей вкладке"""
+        flow_types = list(flow_types)
+        pages = []
+        try:
+            if not await self.prepare(", ".join(flow_types), mode):
+                return
+            
+            outbound_url = self.page.url
+            workers = [self]
+            for _ in flow_types[1:]:
+                page = await self.page.context.new_page()
+                pages.append(page)
+                await page.goto(outbound_url, wait_until="domcontentloaded")
+                workers.append(self._with_page(page))
+            
+            await asyncio.gather(*(worker.watch_flow(flow_type) for worker, flow_type in zip(workers, flow_types)))
+            
+        except Exception as e:
+            print(f"❌ Ошибка: {e}")
+        finally:
+            for page in pages:
+                try:
+                    await page.close()
+                except Exception:
+                    pass
+            await self.close()
+            print("✅ Наблюдение завершено")
+
+    def report_metrics(self):
+        """Таблица замеров и выгрузка в JSON/Prometheus (при включенном профилировании)"""
+        if not self.profile:
+            return
+        print(f"\n⏱️  ПРОФИЛЬ ЗАПУСКА\n{self.metrics.summary_table()}")
+        try:
+            json_filename = self.metrics.export()
+            print(f"💾 Замеры сохранены: {json_filename}, results/metrics.prom")
+        except OSError as e:
+            print(f"⚠️  Не удалось сохранить замеры: {e}")
+
     def display_results(self, items_data, flow_type):
         """Вывод результатов"""
         print(f"\n{'='*80}")
@@ -447,42 +2819,180 @@ class OzonPvzBot:
             if item['Размер']:
                 print(f"   📏 Размер: {item['Размер']}")
             print(f"   🔒 Статус блокировки: {item['Статус_блокировки']}")
+            if item['Перевозка']:
+                print(f"   🚚 Перевозка: {item['Перевозка']}")
 
-    def save_to_files(self, items_data, flow_type):
-        """Сохранение в файлы"""
-        if not items_data:
-            return
+    async def save_items(self, items_data, flow_type):
+        """Сохранение в файлы в отдельном потоке, не блокируя цикл событий"""
+        async with self.stage('save'):
+            await asyncio.to_thread(save_to_files, items_data, flow_type, self.output_formats)
+
+    async def stream_flow(self, flow_type):
+        """Выбор типа потока и запись товаров в файлы по мере прокрутки блока"""
+        async with self.stage('flow_select'):
+            selected = await self.select_flow_type(flow_type)
+        if not selected:
+            print(f"❌ Не удалось выбрать тип потока '{flow_type}'")
+            return 0
+        
+        async with self.stage('block_find'):
+            target_blocks = await self.find_target_blocks()
+        if not target_blocks:
+            print("❌ Не найден целевой блок")
+            return 0
         
+        # Запись идет параллельно с прокруткой, поэтому отдельного этапа 'save' здесь нет.
+        # Перевозки прокручиваются по очереди: файлы пишутся одним потоком записей
+        columns = ITEM_COLUMNS + ('Перевозка',) if len(target_blocks) > 1 else ITEM_COLUMNS
+        async with self.stage('extract'):
+            async with StreamingSink(flow_type, self.output_formats, columns) as sink:
+                for shipment, target_block in target_blocks:
+                    count = await sink.consume(self._tag_shipment(self.harvest_items(target_block), shipment)
+                                               if len(target_blocks) > 1 else self.harvest_items(target_block))
+            self.metrics.add_items(count)
+        print(f"📊 {flow_type}: товаров ДО секции 'Не подходит направление потока': {count}")
+        return count
+
+    async def save_partial_results(self, exceeded):
+        """Отчет о запуске, прерванном по сроку: собранные товары и где остановились"""
+        print(f"⏰ {exceeded}, сохраняю собранное")
         os.makedirs("results", exist_ok=True)
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        base_filename = f"results/ozon_shipment_{flow_type.replace(' ', '_')}_{timestamp}"
+        filename = f"results/partial_run_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+        report = {
+            'stopped_at_stage': exceeded.stage,
+            'deadline_seconds': self.budget.seconds if self.budget else None,
+            'items': {flow_type: len(items_data) if items_data is not None else None
+                      for flow_type, items_data in exceeded.partial.items()},
+            'stages': {name: round(self.metrics.stages[name]['seconds'], 3) for name in self.metrics.ordered_stages()},
+        }
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 Отчет о прерванном запуске: {filename}")
+        
+        # Срок уже вышел: собранное сохраняется без ограничения по времени
+        budget, self.budget = self.budget, None
+        try:
+            for flow_type, items_data in exceeded.partial.items():
+                if items_data:
+                    print(f"📊 {flow_type}: собрано до остановки {len(items_data)} товаров")
+                    await self.publish(items_data, flow_type, display=False)
+        finally:
+            self.budget = budget
+
+    @staticmethod
+    async def _tag_shipment(items, shipment):
+        async for item in items:
+            item.shipment = shipment
+            yield item
+
+    async def publish(self, items_data, flow_type, display=True):
+        """Вывод и сохранение результатов: полный отчет или только изменения"""
+        if self.lookup:
+            await self.lookup.update(flow_type, items_data)
+        if self.diff_mode:
+            async with self.stage('save'):
+                await asyncio.to_thread(self.report_changes, items_data, flow_type)
+            return
+        if display:
+            self.display_results(items_data, flow_type)
+        if self.history:
+            async with self.stage('save'):
+                run_id = await asyncio.to_thread(self.history.add_run, items_data, flow_type)
+            print(f"💾 Запуск #{run_id} сохранен в историю {self.history.path} (файлы: --export-run {run_id})")
+            return
+        await self.save_items(items_data, flow_type)
+
+    #####################################################################################################################
+
+    @staticmethod
+    def _snapshot_filename(flow_type):
+        return f"results/snapshot_{flow_type.replace(' ', '_')}.json"
+
+    def load_snapshot(self, flow_type):
+        """Снимок предыдущего запуска: товары по ключу снимка и отпечатки карточек"""
+        try:
+            with open(self._snapshot_filename(flow_type), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_snapshot(self, items_data, flow_type):
+        """Сохранение снимка текущего запуска"""
+        os.makedirs("results", exist_ok=True)
+        snapshot = {
+            'saved_at': datetime.now().isoformat(timespec='seconds'),
+            'items': {key: dict(item) for key, item in self.snapshot_keys(items_data).items()},
+            'fingerprints': self.fingerprint_caches.get(flow_type, {}),
+        }
+        with open(self._snapshot_filename(flow_type), 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+
+    @staticmethod
+    def snapshot_keys(items_data):
+        """Товары по ключу снимка: штрихкод, а без него - отпечаток карточки с номером повтора"""
+        keyed = {}
+        repeats = {}
+        for item in items_data:
+            barcode = item['Штрихкод']
+            if barcode and barcode != "Не найден":
+                keyed[barcode] = item
+                continue
+            fingerprint = "|".join(str(item.get(field) or "") for field in DIFF_FINGERPRINT_FIELDS)
+            repeats[fingerprint] = repeats.get(fingerprint, 0) + 1
+            keyed[f"Не найден|{fingerprint}|{repeats[fingerprint]}"] = item
+        return keyed
+
+    @classmethod
+    def diff_items(cls, previous, items_data):
+        """Сравнение с предыдущим снимком: добавленные, убранные и измененные товары"""
+        current = cls.snapshot_keys(items_data)
+        
+        added = [item for key, item in current.items() if key not in previous]
+        removed = [item for key, item in previous.items() if key not in current]
+        changed = []
+        for key, item in current.items():
+            old = previous.get(key)
+            if old is None:
+                continue
+            changed_fields = {field: (old.get(field), item[field])
+                              for field in DIFF_FIELDS if old.get(field) != item[field]}
+            if changed_fields:
+                changed.append((item, changed_fields))
+        
+        return {'added': added, 'removed': removed, 'changed': changed}
+
+    def report_changes(self, items_data, flow_type):
+        """Отчет только об изменениях относительно предыдущего запуска"""
+        snapshot = self.load_snapshot(flow_type)
+        diff = self.diff_items(snapshot.get('items', {}), items_data)
+        self.save_snapshot(items_data, flow_type)
+        
+        lines = [
+            f"ИЗМЕНЕНИЯ: {flow_type}",
+            f"Дата: {datetime.now().strftime('%d.%m.%Y %H:%M:%S')}",
+            f"Предыдущий снимок: {snapshot.get('saved_at', 'нет')}",
+            f"Товаров сейчас: {len(items_data)}",
+            f"Добавлено: {len(diff['added'])}, убрано: {len(diff['removed'])}, изменено: {len(diff['changed'])}",
+            "=" * 60,
+        ]
+        for item in diff['added']:
+            lines.append(f"+ {item['Штрихкод']} | {item['Ячейка']} | {item['Название']}")
+        for item in diff['removed']:
+            lines.append(f"- {item['Штрихкод']} | {item['Ячейка']} | {item['Название']}")
+        for item, changed_fields in diff['changed']:
+            changes = ", ".join(f"{field}: {old} → {new}" for field, (old, new) in changed_fields.items())
+            lines.append(f"* {item['Штрихкод']} | {item['Название']} | {changes}")
+        
+        print("\n" + "\n".join(lines))
         
-        # Excel
-        df = pd.DataFrame(items_data)
-        excel_filename = f"{base_filename}.xlsx"
-        df.to_excel(excel_filename, index=False)
-        print(f"💾 Excel файл сохранен: {excel_filename}")
+        if not (diff['added'] or diff['removed'] or diff['changed']):
+            return
         
-        # TXT
-        txt_filename = f"{base_filename}.txt"
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        txt_filename = f"results/ozon_diff_{flow_type.replace(' ', '_')}_{timestamp}.txt"
         with open(txt_filename, 'w', encoding='utf-8') as f:
-            f.write(f"ОТЧЕТ: {flow_type}\n")
-            f.write(f"Дата: {datetime.now().strftime('%d.%m.%Y %H:%M:%S')}\n")
-            f.write(f"Товаров ДО секции 'Не подходит направление потока': {len(items_data)}\n")
-            f.write("=" * 60 + "\n\n")
-            
-            for i, item in enumerate(items_data, 1):
-                f.write(f"ТОВАР #{i}\n")
-                f.write(f"Название: {item['Название']}\n")
-                f.write(f"Ячейка: {item['Ячейка']}\n")
-                f.write(f"Штрихкод: {item['Штрихкод']}\n")
-                f.write(f"Тип потока: {item['Тип_потока']}\n")
-                if item['Цвет']:
-                    f.write(f"Цвет: {item['Цвет']}\n")
-                if item['Размер']:
-                    f.write(f"Размер: {item['Размер']}\n")
-                f.write(f"Статус блокировки: {item['Статус_блокировки']}\n")
-                f.write("-" * 40 + "\n\n")
+            f.write("\n".join(lines) + "\n")
+        print(f"💾 Отчет об изменениях сохранен: {txt_filename}")
 
     async def close(self):
         """Корректное закрытие ресурсов"""
@@ -494,29 +3004,363 @@ class OzonPvzBot:
         except Exception as e:
             print(f"⚠️  Предупреждение при закрытии: {e}")
 
+class PointCoordinator:
+    """Сбор данных по нескольким пунктам выдачи, у каждого свой браузер
+    
+    Пункты описываются словарями: name, cdp_url и необязательные
+    user_data_dir, browser_path, browser_args, selector_cache_file. Внутри
+    процесса одновременно работают не больше concurrency ботов; при
+    processes > 1 пункты делятся между процессами, у каждого свой цикл событий.
+    Прокрутка, профилирование и блокировка ресурсов включаются у ботов всех пунктов.
+    """
+    
+    def __init__(self, points, flow_types=FLOW_TYPES, mode="dom", concurrency=4, processes=1,
+                 output_formats=("xlsx", "txt"), history=None, deadline=None, scroll_harvest=False,
+                 profile=False, block_resources=False, allowlist=()):
+        self.points = list(points)
+        self.flow_types = list(flow_types)
+        self.mode = mode
+        self.concurrency = concurrency
+        self.processes = processes
+        self.output_formats = tuple(output_formats)
+        self.history = history
+        self.deadline = deadline
+        self.scroll_harvest = scroll_harvest
+        self.profile = profile
+        self.block_resources = block_resources
+        self.allowlist = tuple(allowlist)
+    
+    @staticmethod
+    def load_points(filename):
+        """Список пунктов из JSON-файла"""
+        with open(filename, encoding='utf-8') as f:
+            points = json.load(f)
+        for i, point in enumerate(points):
+            point.setdefault('name', f"Пункт {i + 1}")
+            point.setdefault('cdp_url', f"http://localhost:{9222 + i}")
+        return points
+    
+    def worker_spec(self):
+        """Параметры сбора для дочернего процесса
+        
+        История остается в родительском процессе: соединение SQLite не
+        передается между процессами, результаты пишутся в нее после сбора.
+        """
+        return {'flow_types': self.flow_types, 'mode': self.mode, 'concurrency': self.concurrency,
+                'output_formats': self.output_formats, 'deadline': self.deadline,
+                'scroll_harvest': self.scroll_harvest, 'profile': self.profile,
+                'block_resources': self.block_resources, 'allowlist': self.allowlist}
+    
+    async def run_point(self, point):
+        """Сбор по одному пункту; ошибки пункта не прерывают остальные"""
+        started = time.perf_counter()
+        result = {'point': point['name'], 'status': "ошибка", 'items': ItemBatch(), 'error': "", 'seconds': 0.0}
+        bot = OzonPvzBot(
+            cdp_url=point['cdp_url'],
+            user_data_dir=point.get('user_data_dir', f"./edge_profile_{point['name']}"),
+            browser_path=point.get('browser_path'),
+            browser_args=point.get('browser_args', ()),
+            selector_cache_file=point.get('selector_cache_file', "selector_cache.json"),
+            interactive=False,
+            kill_existing_edge=False,
+            budget=RunBudget(self.deadline) if self.deadline else None,
+            scroll_harvest=self.scroll_harvest,
+            profile=self.profile,
+            resource_blocker=ResourceBlocker(self.allowlist) if self.block_resources else None,
+        )
+        try:
+            items_by_flow = await bot.collect_point(self.flow_types, self.mode)
+            if items_by_flow is None:
+                result['error'] = "страница перевозок недоступна"
+            else:
+                failed = [flow_type for flow_type, items_data in items_by_flow.items() if items_data is None]
+                for items_data in items_by_flow.values():
+                    result['items'].extend(items_data or [])
+                result['items'].tag('point', point['name'])
+                if len(failed) == len(items_by_flow):
+                    result['status'] = "ошибка"
+                else:
+                    result['status'] = "частично" if failed else "ok"
+                if failed:
+                    result['error'] = f"не собраны: {', '.join(failed)}"
+        except BudgetExceeded as e:
+            for items_data in e.partial.values():
+                result['items'].extend(items_data or [])
+            result['items'].tag('point', point['name'])
+            result['status'] = "частично"
+            result['error'] = str(e)
+        except Exception as e:
+            result['error'] = str(e)
+        result['seconds'] = time.perf_counter() - started
+        print(f"🏁 {point['name']}: {result['status']}, товаров: {len(result['items'])}, {result['seconds']:.1f} с")
+        if bot.resource_blocker:
+            print(f"🛡️  {point['name']}:")
+            bot.resource_blocker.report()
+        if self.profile:
+            # Замеры пунктов сохраняются одним файлом в run(), здесь только таблица
+            print(f"\n⏱️  ПРОФИЛЬ ПУНКТА {point['name']}\n{bot.metrics.summary_table()}")
+            result['metrics'] = bot.metrics.to_dict()
+        return result
+    
+    async def run_points(self, points):
+        """Сбор по списку пунктов с ограничением одновременно работающих ботов"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        
+        async def limited(point):
+            async with semaphore:
+                return await self.run_point(point)
+        
+        return await asyncio.gather(*(limited(point) for point in points))
+    
+    async def run(self):
+        """Сбор по всем пунктам, общий отчет и таблица статусов"""
+        started = time.perf_counter()
+        if self.processes > 1:
+            chunks = [self.points[i::self.processes] for i in range(self.processes)]
+            loop = asyncio.get_running_loop()
+            with ProcessPoolExecutor(max_workers=self.processes) as pool:
+                parts = await asyncio.gather(*(
+                    loop.run_in_executor(pool, _run_points_in_process, self.worker_spec(), chunk)
+                    for chunk in chunks if chunk
+                ))
+            results = [result for part in parts for result in part]
+        else:
+            results = await self.run_points(self.points)
+        
+        all_items = ItemBatch()
+        for result in results:
+            all_items.extend(result['items'])
+            if self.history and result['status'] != "ошибка":
+                await asyncio.to_thread(self.history.add_run, result['items'], ", ".join(self.flow_types), result['point'])
+        
+        if not self.history:
+            await asyncio.to_thread(save_to_files, all_items, "Все пункты", self.output_formats,
+                                    ITEM_COLUMNS + ('Пункт',))
+        if self.profile:
+            self.save_metrics(results)
+        self.save_status(results, time.perf_counter() - started)
+        return results
+    
+    def save_metrics(self, results):
+        """Замеры по этапам всех пунктов в одном JSON"""
+        json_filename = report_base_filename("пункты", prefix="metrics") + ".json"
+        with open(json_filename, 'w', encoding='utf-8') as f:
+            json.dump({result['point']: result.get('metrics') for result in results}, f, ensure_ascii=False, indent=2)
+        print(f"💾 Замеры пунктов сохранены: {json_filename}")
+    
+    def save_status(self, results, total_seconds):
+        """Таблица статусов по пунктам: в консоль и в TXT"""
+        lines = [
+            f"СТАТУС ПУНКТОВ: {datetime.now().strftime('%d.%m.%Y %H:%M:%S')}",
+            f"Пунктов: {len(results)}, успешно: {sum(r['status'] == 'ok' for r in results)}, "
+            f"общее время: {total_seconds:.1f} с",
+            "=" * 60,
+        ]
+        for result in results:
+            line = f"{result['point']:<20} {result['status']:<7} товаров: {len(result['items']):>5}  {result['seconds']:>7.1f} с"
+            if result['error']:
+                line += f"  {result['error']}"
+            lines.append(line)
+        
+        print("\n" + "\n".join(lines))
+        txt_filename = report_base_filename("статус", prefix="ozon_points") + ".txt"
+        with open(txt_filename, 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+        print(f"💾 Статус пунктов сохранен: {txt_filename}")
+
+def _run_points_in_process(spec, points):
+    """Сбор части пунктов в отдельном процессе со своим циклом событий"""
+    return asyncio.run(PointCoordinator(points, **spec).run_points(points))
+
+def parse_args():
+    """Параметры командной строки"""
+    parser = argparse.ArgumentParser(description="Бот для Турбо ПВЗ")
+    parser.add_argument("--flow", choices=["direct", "return", "both"],
+                        help="тип потока без интерактивного выбора")
+    parser.add_argument("--mode", choices=["dom", "api", "html"], default="dom",
+                        help="источник данных: DOM страницы, перехваченные ответы API или "
+                             "HTML страницы, разобранный без браузера (сохраняется для --reparse)")
+    parser.add_argument("--dump-api", metavar="DIR",
+                        help="сохранять перехваченные ответы API в папку, по подкаталогу на тип потока (для фикстур)")
+    parser.add_argument("--replay-api", metavar="DIR",
+                        help="разобрать сохраненные ответы API без подключения к браузеру")
+    parser.add_argument("--reparse", metavar="PATH", nargs="?", const=PAGE_SNAPSHOT_DIR,
+                        help=f"разобрать сохраненные страницы (файл или папка, по умолчанию {PAGE_SNAPSHOT_DIR}) без браузера")
+    parser.add_argument("--format", default="xlsx,txt",
+                        help="форматы файлов через запятую: " + ", ".join(ITEM_WRITERS) + " (по умолчанию xlsx,txt)")
+    parser.add_argument("--scroll", action="store_true",
+                        help="собирать товары с прокруткой блока (для длинных списков с ленивой подгрузкой)")
+    parser.add_argument("--diff", action="store_true",
+                        help="сравнивать с предыдущим запуском и сохранять только изменения")
+    parser.add_argument("--points", metavar="FILE",
+                        help="JSON-файл со списком пунктов выдачи для параллельного сбора")
+    parser.add_argument("--concurrency", type=int, default=4,
+                        help="сколько пунктов собирать одновременно (по умолчанию 4)")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="на сколько процессов распределить пункты (по умолчанию 1)")
+    parser.add_argument("--block-resources", action="store_true",
+                        help="не загружать картинки, медиа, шрифты и сторонние счетчики")
+    parser.add_argument("--allow", action="append", default=[], metavar="URL_PART",
+                        help="не блокировать запросы, URL которых содержит эту подстроку (можно несколько раз)")
+    parser.add_argument("--history", action="store_true",
+                        help="сохранять запуски в базу истории вместо отдельных файлов")
+    parser.add_argument("--history-db", default="results/history.sqlite3", metavar="FILE",
+                        help="файл базы истории (по умолчанию results/history.sqlite3)")
+    parser.add_argument("--history-barcode", metavar="BARCODE",
+                        help="показать историю товара по штрихкоду и время в ячейках")
+    parser.add_argument("--history-runs", action="store_true",
+                        help="показать последние запуски из истории")
+    parser.add_argument("--export-run", type=int, metavar="ID",
+                        help="выгрузить запуск из истории в файлы (форматы из --format)")
+    parser.add_argument("--profile", action="store_true",
+                        help="замерять этапы и вызовы Playwright, в конце вывести таблицу и сохранить JSON/Prometheus")
+    parser.add_argument("--watch", action="store_true",
+                        help="живое наблюдение за блоком: изменения приходят из страницы, отчет обновляется до Ctrl+C")
+    parser.add_argument("--serve", type=int, metavar="PORT",
+                        help="справочный HTTP-сервис на 127.0.0.1:PORT: /barcode/<код>, /prefix/<начало>, "
+                             "/cell/<ячейка>, /health; обновляется после каждого сбора")
+    parser.add_argument("--deadline", type=float, metavar="SEC",
+                        help="общий срок запуска (в фоновом режиме - цикла), делится между этапами; "
+                             "по истечении собранное сохраняется и запуск останавливается")
+    parser.add_argument("--daemon", action="store_true",
+                        help="фоновый режим: держать подключение и собирать данные по расписанию")
+    parser.add_argument("--interval", type=int, default=300,
+                        help="период сбора в фоновом режиме, с (по умолчанию 300)")
+    return parser.parse_args()
+
+def choose_flow_types(args):
+    """Типы потоков из параметров командной строки или интерактивного выбора"""
+    choice = {"direct": "1", "return": "2", "both": "3"}.get(args.flow)
+    
+    if choice is None and (args.daemon or args.points):
+        choice = "3"
+    
+    # Тип потока сохраненной страницы берется из имени файла
+    if choice is None and args.reparse:
+        choice = "1"
+    
+    if choice is None:
+        print("Типы потоков:")
+        print("1 - Прямой поток")
+        print("2 - Возвратный поток")
+        print("3 - Оба потока (параллельно)")
+        
+        choice = input("Выберите тип (1, 2 или 3): ").strip()
+    
+    if choice == "2":
+        return ["Возвратный поток"]
+    if choice == "3":
+        return list(FLOW_TYPES)
+    return ["Прямой поток"]
+
+def show_history(history, args, output_formats):
+    """Запросы к базе истории без подключения к браузеру"""
+    if args.history_runs:
+        print("📚 Последние запуски:")
+        for run in history.run_counts():
+            point = f" [{run['point']}]" if run['point'] else ""
+            print(f"   #{run['id']} {run['started_at']} {run['flow_type']}{point}: товаров {run['item_count']}")
+    
+    if args.history_barcode:
+        rows = history.item_history(args.history_barcode)
+        print(f"📚 Товар {args.history_barcode}: найден в запусках: {len(rows)}")
+        for row in rows:
+            print(f"   #{row['run_id']} {row['started_at']} {row['flow_type']} | ячейка {row['cell']} | {row['lock_status']}")
+        for stay in history.dwell_time(args.history_barcode):
+            print(f"   📍 {stay['cell']}: с {stay['first_seen']} по {stay['last_seen']} "
+                  f"({stay['duration']}, запусков: {stay['runs']})")
+    
+    if args.export_run:
+        history.export_run(args.export_run, output_formats)
+
 async def main():
     """Основная функция"""
+    args = parse_args()
+    
     print("🤖 Бот для Турбо ПВЗ")
     print("👉 Собирает товары ДО секции 'Не подходит направление потока'")
     print("=" * 50)
     
-    print("Типы потоков:")
-    print("1 - Прямой поток")
-    print("2 - Возвратный поток")
+    output_formats = [fmt.strip() for fmt in args.format.split(",") if fmt.strip()]
+    unknown = [fmt for fmt in output_formats if fmt not in ITEM_WRITERS]
+    if unknown:
+        print(f"❌ Неизвестные форматы: {', '.join(unknown)}")
+        return
     
-    choice = input("Выберите тип (1 или 2): ").strip()
+    if args.history_barcode or args.history_runs or args.export_run:
+        show_history(HistoryStore(args.history_db), args, output_formats)
+        return
     
-    if choice == "2":
-        flow_type = "Возвратный поток"
-    else:
-        flow_type = "Прямой поток"
+    flow_types = choose_flow_types(args)
+    # Ожидание оператора в диалогах выше во время запуска не входит
+    started_at = time.perf_counter()
+    
+    if args.points:
+        # Снимки --diff, справочный сервис, фоновые режимы и разбор сохраненного рассчитаны на один пункт
+        unsupported = [flag for flag, enabled in (
+            ("--diff", args.diff), ("--serve", args.serve), ("--daemon", args.daemon), ("--watch", args.watch),
+            ("--replay-api", args.replay_api), ("--reparse", args.reparse),
+        ) if enabled]
+        if unsupported:
+            print(f"❌ С --points нельзя использовать: {', '.join(unsupported)}")
+            return
+        coordinator = PointCoordinator(
+            PointCoordinator.load_points(args.points), flow_types, mode=args.mode,
+            concurrency=args.concurrency, processes=args.processes, output_formats=output_formats,
+            history=HistoryStore(args.history_db) if args.history else None, deadline=args.deadline,
+            scroll_harvest=args.scroll, profile=args.profile, block_resources=args.block_resources,
+            allowlist=args.allow,
+        )
+        await coordinator.run()
+        return
     
-    bot = OzonPvzBot()
-    await bot.run(flow_type)
+    lookup = LookupService(args.serve) if args.serve else None
+    bot = OzonPvzBot(api_dump_dir=args.dump_api, interactive=not args.daemon, diff_mode=args.diff,
+                     scroll_harvest=args.scroll, output_formats=output_formats, profile=args.profile,
+                     resource_blocker=ResourceBlocker(args.allow) if args.block_resources else None,
+                     history=HistoryStore(args.history_db) if args.history else None, lookup=lookup,
+                     budget=RunBudget(args.deadline) if args.deadline and not args.watch else None,
+                     started_at=started_at)
+    if lookup is None:
+        await run_bot(bot, args, flow_types)
+        return
+    
+    await lookup.start()
+    try:
+        await run_bot(bot, args, flow_types)
+        # После разового сбора сервис продолжает отвечать по собранным товарам
+        if not (args.daemon or args.watch):
+            await lookup.serve_forever()
+    finally:
+        await lookup.close()
+
+async def run_bot(bot, args, flow_types):
+    """Запуск бота в режиме, выбранном в командной строке"""
+    if args.replay_api:
+        if len(flow_types) > 1:
+            print("❌ Разбор сохраненных ответов выполняется для одного типа потока")
+            return
+        items_data = bot.load_api_dump(args.replay_api, flow_types[0])
+        await bot.publish(items_data, flow_types[0])
+        return
+    if args.reparse:
+        await bot.reparse_page_snapshots(args.reparse, flow_types[0])
+        return
+    if args.daemon:
+        await bot.run_daemon(flow_types, args.interval, mode=args.mode)
+        return
+    if args.watch:
+        await bot.run_watch(flow_types)
+        return
+    if len(flow_types) > 1:
+        await bot.run_all_flows(flow_types, mode=args.mode)
+        return
+    await bot.run(flow_types[0], mode=args.mode)
 
 if __name__ == "__main__":
-    print("Установите: pip install playwright pandas openpyxl psutil")
-    input("Нажмите Enter для запуска...")
+    print("Установите: pip install playwright openpyxl psutil")
+    if len(sys.argv) == 1:
+        input("Нажмите Enter для запуска...")
     
     try:
         asyncio.run(main())